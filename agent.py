@@ -1,11 +1,45 @@
+import bisect
 import random
+import numpy as np
+
+# Integer status codes used by the array based engines (index into STATUS_NAMES)
+SUSCEPTIBLE, INFECTED, RECOVERED, DEAD = 0, 1, 2, 3
+STATUS_NAMES = "SIRD"
+
+BASE_TRANSMISSION_PROB = 0.15  # Lower base probability
+
+# Age-based risk factors, one row per band: (band starts at age, transmitter factor, receiver factor)
+AGE_BANDS = (
+    (0, 0.8, 0.7),   # Children may transmit less and may be less susceptible
+    (18, 1.0, 1.0),  # Adults normal transmission and susceptibility
+    (60, 0.9, 1.5),  # Elderly may have fewer contacts but higher viral load, and are more susceptible
+)
+
+
+def immunity_factor(immunity):
+    return 1 - immunity * immunity  # Square makes immunity more significant
+
+
+def transmission_factors(age, immunity, bands=AGE_BANDS):
+    """Per-agent (transmit, receive) factor arrays for the age and immunity arrays.
+
+    A contact from i to j transmits with probability base_prob * transmit[i] * receive[j],
+    the receive factor already includes the immunity term.
+    """
+    starts = np.array([band[0] for band in bands])
+    band = np.searchsorted(starts, age, side="right") - 1
+    transmit = np.array([band[1] for band in bands], dtype=np.float64)[band]
+    receive = np.array([band[2] for band in bands], dtype=np.float64)[band]
+    return transmit, receive * immunity_factor(np.asarray(immunity, dtype=np.float64))
 
 class Agent:
     base_infection_probability = 0.3
+    age_bands = AGE_BANDS
     def __init__(self, id, age, immunity, mobility, cluster=None):
         self.id = id
-        self.age = age
-        self.immunity = immunity
+        self._age = age
+        self._immunity = immunity
+        self._update_factors()
         self.mobility = mobility
         self.cluster = cluster
         self.status = "S"  # S: susceptible, I: infected, R: recovered, D: dead
@@ -13,6 +47,32 @@ class Agent:
         self.last_infected_timestep = -1
         self.recovery_time = random.randint(10, 16)  # Random recovery time between 10-16 days
 
+    # Factors of attempt_to_infect_neighbour, recomputed only when age or immunity change:
+    # transmit_factor = transmitter factor, receive_factor = receiver factor * immunity factor,
+    # the same as transmission_factors() gives for the agent
+    def _update_factors(self):
+        band = self.age_bands[bisect.bisect_right([b[0] for b in self.age_bands], self._age) - 1]
+        self.transmit_factor = band[1]
+        self.receive_factor = band[2] * immunity_factor(self._immunity)
+
+    @property
+    def age(self):
+        return self._age
+
+    @age.setter
+    def age(self, value):
+        self._age = value
+        self._update_factors()
+
+    @property
+    def immunity(self):
+        return self._immunity
+
+    @immunity.setter
+    def immunity(self, value):
+        self._immunity = value
+        self._update_factors()
+
     def decide_to_infect_neighbours(self):
         count_to_infect = int(len(self.neighbours) * self.mobility)
         if len(self.neighbours) == 0 or count_to_infect <= 0:
@@ -23,32 +83,8 @@ class Agent:
     
     def attempt_to_infect_neighbour(self, neighbour_agent, timestep):
         if self.status == "I" and neighbour_agent.status == "S":
-            # Base probability
-            base_prob = 0.15  # Lower base probability
-            
-            # Age-based risk factors for infection transmission
-            if self.age < 18:
-                transmitter_factor = 0.8  # Children may transmit less
-            elif 18 <= self.age < 60:
-                transmitter_factor = 1.0  # Adults normal transmission
-            else:
-                transmitter_factor = 0.9  # Elderly may have fewer contacts but higher viral load
-                
-            # Age-based susceptibility of receiver
-            if neighbour_agent.age < 18:
-                receiver_factor = 0.7  # Children may be less susceptible
-            elif 18 <= neighbour_agent.age < 60:
-                receiver_factor = 1.0  # Adults normal susceptibility
-            else:
-                receiver_factor = 1.5  # Elderly more susceptible
-                
-            # Immunity factor (stronger effect)
-            immunity_factor = 1 - (neighbour_agent.immunity * neighbour_agent.immunity)  # Square makes immunity more significant
-            
-            # Calculate final probability
-            prob = base_prob * transmitter_factor * receiver_factor * immunity_factor
-            
-            if random.random() < prob:
+            # Age and immunity factors are precomputed (see AGE_BANDS)
+            if random.random() < BASE_TRANSMISSION_PROB * self.transmit_factor * neighbour_agent.receive_factor:
                 neighbour_agent.infect(timestep)
                 return True
         return False
@@ -0,0 +1,208 @@
+"""Benchmarks for graph generation, stepping and rendering.
+
+    python benchmarks/bench.py run --output results.json
+    python benchmarks/bench.py run --sizes 1000 10000 --output quick.json
+    python benchmarks/bench.py compare results.json baseline.json
+
+Every (phase, size) runs in a fresh process so its peak RSS is not inflated by the
+phases before it. Peak RSS covers the whole process, including building the
+population the phase works on. Rendering goes through pygame's dummy video driver.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+PHASES = ("generate", "layout", "step", "render")
+SEED = 12345
+STEPS = 20
+FRAMES = 20
+SCREEN_SIZE = (1280, 800)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_population(size):
+    from graphs_and_clustering import create_graph
+    return create_graph(size, seed=SEED)
+
+
+def bench_generate(size):
+    from graphs_and_clustering import create_graph
+    start = time.perf_counter()
+    population = create_graph(size, seed=SEED)
+    wall = time.perf_counter() - start
+    return {"wall_s": wall, "edges": population.num_edges}
+
+
+def bench_layout(size):
+    import layout
+    population = make_population(size)
+    start = time.perf_counter()
+    layout.cluster_layout(population)  # not cached_layout, the disk cache would hide the cost
+    return {"wall_s": time.perf_counter() - start}
+
+
+def bench_step(size):
+    import numpy as np
+    import ensemble
+    population = make_population(size)
+    engine = ensemble.start_engine(population, np.random.default_rng(SEED))
+    times = []
+    for _ in range(STEPS):
+        start = time.perf_counter()
+        engine.step()
+        times.append(time.perf_counter() - start)
+    return {"wall_s": sum(times), "per_step_s": sum(times) / len(times), "max_step_s": max(times),
+            "steps": STEPS, "update": engine.update, "final_counts": engine.status_counts}
+
+
+def bench_render(size):
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+    import numpy as np
+    import pygame
+    import ensemble
+    import layout
+    from camera import Camera
+    from renderer import GraphRenderer
+    population = make_population(size)
+    engine = ensemble.start_engine(population, np.random.default_rng(SEED))
+    world = layout.cluster_layout(population) * (SCREEN_SIZE[0] - 100, SCREEN_SIZE[1] - 100) + 50
+    pygame.init()
+    screen = pygame.display.set_mode(SCREEN_SIZE)
+    renderer = GraphRenderer(*population.edges())
+    camera = Camera()
+
+    # half the frames move the camera (edge layer rebuilt), half only redraw the nodes
+    rebuild, cached = [], []
+    try:
+        for frame in range(FRAMES):
+            moved = frame % 2 == 0
+            if moved:
+                camera.zoom_at(SCREEN_SIZE[0] / 2, SCREEN_SIZE[1] / 2, 1.0 + 0.05 * (frame % 8))
+                renderer.invalidate()
+            start = time.perf_counter()
+            renderer.draw(screen, camera.world_to_screen(world), engine.status, max(1, int(camera.scale)))
+            pygame.display.flip()
+            (rebuild if moved else cached).append(time.perf_counter() - start)
+    finally:
+        pygame.quit()
+    return {"wall_s": sum(rebuild) + sum(cached), "per_frame_rebuild_s": sum(rebuild) / len(rebuild),
+            "per_frame_cached_s": sum(cached) / len(cached), "frames": FRAMES}
+
+
+BENCHMARKS = {"generate": bench_generate, "layout": bench_layout, "step": bench_step, "render": bench_render}
+
+
+def _run_one(phase, size):
+    result = BENCHMARKS[phase](size)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_isolated(phase, size):
+    """Run one benchmark in a fresh process, returns its result dict"""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(_run_one, (phase, size))
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, phases):
+    results = []
+    for size in sizes:
+        for phase in phases:
+            result = run_isolated(phase, size)
+            result.update(phase=phase, size=size)
+            results.append(result)
+            print(f"{phase:>9} {size:>9}: {result['wall_s']:8.3f} s  {result['peak_rss_mb']:8.1f} MB peak RSS",
+                  flush=True)
+    return {
+        "meta": {"revision": git_revision(), "python": platform.python_version(), "machine": platform.machine(),
+                 "platform": platform.platform(), "cpus": os.cpu_count(), "seed": SEED,
+                 "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+
+
+def compare(current, baseline, time_tolerance=0.10, rss_tolerance=0.10, min_wall_s=0.005):
+    """Regressions of current against baseline as a list of messages.
+
+    A phase regresses when its wall time (or peak RSS) grew by more than the tolerance.
+    Timings below min_wall_s are too noisy to judge and only their RSS is checked.
+    """
+    old = {(r["phase"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = (result["phase"], result["size"])
+        if key not in old:
+            continue
+        before = old[key]
+        for metric, tolerance in (("wall_s", time_tolerance), ("peak_rss_mb", rss_tolerance)):
+            if metric == "wall_s" and before[metric] < min_wall_s:
+                continue
+            ratio = result[metric] / before[metric] if before[metric] else float("inf")
+            line = f"{key[0]:>9} {key[1]:>9} {metric:>11}: {before[metric]:10.3f} -> {result[metric]:10.3f} ({ratio - 1:+.1%})"
+            if ratio > 1 + tolerance:
+                regressions.append(line)
+            print(("REGRESSION " if ratio > 1 + tolerance else "           ") + line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark generation, stepping and rendering")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    run.add_argument("--phases", nargs="+", choices=PHASES, default=PHASES)
+    run.add_argument("-o", "--output", default="benchmark_results.json")
+    run.add_argument("--baseline", help="compare against this results file when done")
+    run.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown (default 10%%)")
+    cmp = commands.add_parser("compare", help="compare a results file against a baseline")
+    cmp.add_argument("results")
+    cmp.add_argument("baseline")
+    cmp.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown (default 10%%)")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        current = run_suite(args.sizes, args.phases)
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+        baseline_path = args.baseline
+    else:
+        with open(args.results) as f:
+            current = json.load(f)
+        baseline_path = args.baseline
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance, args.tolerance)
+        print(f"{len(regressions)} regression(s)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
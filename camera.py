@@ -0,0 +1,38 @@
+import numpy as np
+
+
+class Camera:
+    """Maps world space to screen space: screen = world * scale + offset.
+
+    World positions (the layout) are never touched, zooming and panning only change
+    scale and offset, and the whole population is transformed once per frame in
+    world_to_screen. Caches built in screen space (the edge layer) compare (scale,
+    offset) with what they were built for, a changed offset alone is a pan.
+    """
+
+    def __init__(self, min_scale=0.2, max_scale=8.0):
+        self.scale = 1.0
+        self.offset = np.zeros(2)
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+
+    def world_to_screen(self, points):
+        """(n, 2) world positions to integer pixel positions"""
+        return np.rint(points * self.scale + self.offset).astype(np.int64)
+
+    def screen_to_world(self, x, y):
+        return (x - self.offset[0]) / self.scale, (y - self.offset[1]) / self.scale
+
+    def zoom_at(self, x, y, scale):
+        """Set the zoom to scale (clamped) keeping the world point under screen pixel (x, y) in place"""
+        scale = max(self.min_scale, min(self.max_scale, scale))
+        if scale == self.scale:
+            return
+        wx, wy = self.screen_to_world(x, y)
+        self.scale = scale
+        self.offset = np.array([x - wx * scale, y - wy * scale])
+
+    def pan(self, dx, dy):
+        """Move the view by (dx, dy) screen pixels"""
+        if dx or dy:
+            self.offset = self.offset + (dx, dy)
@@ -0,0 +1,160 @@
+import glob
+import json
+import os
+import numpy as np
+import step_engine
+
+# A checkpoint directory holds one full checkpoint plus the deltas written after it:
+#   full-<step>.npz   status and infection timestep of every agent
+#   delta-<seq>.npz   only the agents whose status or infection timestep changed since the previous checkpoint
+# Both kinds also carry the step, status counts, the history rows added since the previous
+# checkpoint, the RNG state, the engine settings and which dead agents the engine's adjacency
+# was compacted without (bit packed), so a run resumes bit-for-bit.
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def _rng_state(rng):
+    return json.dumps(rng.bit_generator.state)
+
+
+def _make_rng(state_json):
+    state = json.loads(state_json)
+    rng = np.random.Generator(getattr(np.random, state["bit_generator"])())
+    rng.bit_generator.state = state
+    return rng
+
+
+def _write_atomic(path, **arrays):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+class Checkpointer:
+    """Writes periodic checkpoints of a StepEngine into directory.
+
+    The first checkpoint (and every full_every-th after it) stores the full dynamic
+    state, the others only the agents that changed since the previous one. Older
+    files are removed when a new full checkpoint is written.
+    """
+
+    def __init__(self, directory, full_every=10):
+        self.directory = directory
+        self.full_every = full_every
+        self._since_full = None
+        self._status = None
+        self._last_infected = None
+        self._history_len = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, engine):
+        """Checkpoint the current state of engine, returns the path written"""
+        engine.settle_compaction()
+        compacted = engine.compacted if engine.compacted is not None else np.zeros(engine.n, dtype=bool)
+        common = {
+            "time_step": np.int64(engine.time_step),
+            "status_counts": np.array(list(engine.status_counts.values()), dtype=np.int64),
+            "history": np.array(engine.history[self._history_len:], dtype=np.int64).reshape(-1, 4),
+            "rng_state": np.array(_rng_state(engine.rng)),
+            "compacted": np.packbits(compacted),
+            "settings": np.array(json.dumps({"engine": type(engine).__name__, "size": engine.n,
+                                             "mortality_rate": engine.mortality_rate,
+                                             "base_prob": engine.base_prob,
+                                             "seed": getattr(engine, "seed", None),
+                                             "compact_dead_fraction": engine.compact_dead_fraction,
+                                             "update": engine.update})),
+        }
+        if self._since_full is None or self._since_full + 1 >= self.full_every:
+            # old deltas go first, so whatever a crash leaves behind is still a consistent chain
+            for old in glob.glob(os.path.join(self.directory, "delta-*.npz")):
+                os.remove(old)
+            path = os.path.join(self.directory, f"full-{engine.time_step:09d}.npz")
+            common["history"] = np.array(engine.history, dtype=np.int64).reshape(-1, 4)
+            _write_atomic(path, status=engine.status, last_infected_timestep=engine.last_infected_timestep, **common)
+            for old in glob.glob(os.path.join(self.directory, "full-*.npz")):
+                if old != path:
+                    os.remove(old)
+            self._since_full = 0
+            self._status = engine.status.copy()
+            self._last_infected = engine.last_infected_timestep.copy()
+        else:
+            changed = np.flatnonzero((engine.status != self._status)
+                                     | (engine.last_infected_timestep != self._last_infected))
+            self._since_full += 1
+            path = os.path.join(self.directory, f"delta-{self._since_full:06d}.npz")
+            _write_atomic(path, ids=changed, status=engine.status[changed],
+                          last_infected_timestep=engine.last_infected_timestep[changed], **common)
+            self._status[changed] = engine.status[changed]
+            self._last_infected[changed] = engine.last_infected_timestep[changed]
+        self._history_len = len(engine.history)
+        return path
+
+
+def restore(directory, population):
+    """Rebuild the engine saved in directory on top of population (same static columns as the saved run)"""
+    fulls = sorted(glob.glob(os.path.join(directory, "full-*.npz")))
+    if not fulls:
+        raise CheckpointError(f"No checkpoint in {directory}")
+    base = fulls[-1]
+    # writing a full checkpoint removes the older deltas, so every delta left belongs to the newest one
+    deltas = sorted(glob.glob(os.path.join(directory, "delta-*.npz")))
+
+    with np.load(base) as data:
+        settings = json.loads(str(data["settings"]))
+        if settings["size"] != len(population):
+            raise CheckpointError(f"Checkpoint is for {settings['size']} agents, population has {len(population)}")
+        population.status[:] = data["status"]
+        population.last_infected_timestep[:] = data["last_infected_timestep"]
+        history = [tuple(row) for row in data["history"].tolist()]
+        latest = _latest(data)
+
+    for path in deltas:
+        with np.load(path) as data:
+            ids = data["ids"]
+            population.status[ids] = data["status"]
+            population.last_infected_timestep[ids] = data["last_infected_timestep"]
+            history.extend(tuple(row) for row in data["history"].tolist())
+            latest = _latest(data)
+
+    engine_class = getattr(step_engine, settings["engine"])
+    # counter-based engines carry no stream state, their seed is all they need
+    optional = {name: settings[name] for name in ("seed", "compact_dead_fraction") if settings.get(name) is not None}
+    # checkpoints from before update modes existed are of synchronous runs
+    engine = engine_class(population, mortality_rate=settings["mortality_rate"], base_prob=settings["base_prob"],
+                          rng=_make_rng(str(latest["rng_state"])), update=settings.get("update", step_engine.SYNCHRONOUS),
+                          **optional)
+    engine.time_step = int(latest["time_step"])
+    engine.history = history
+    engine.status_counts = dict(zip(engine.status_counts, latest["status_counts"].tolist()))
+    if "compacted" in latest:
+        compacted = np.unpackbits(latest["compacted"], count=engine.n).astype(bool)
+        if compacted.any():
+            engine.use_compaction(compacted)
+    return engine
+
+
+def _latest(data):
+    # checkpoints written before compaction existed have no "compacted"
+    names = ("time_step", "status_counts", "rng_state", "compacted")
+    return {name: data[name] for name in names if name in data.files}
+
+
+def run_with_checkpoints(engine, until_step, checkpointer, every=50, recorder=None):
+    """Step engine up to until_step, checkpointing every `every` steps and at the end.
+
+    Every step is also handed to recorder (a recorder.Recorder) if one is given, and it is
+    flushed at every checkpoint.
+    """
+    while engine.time_step < until_step:
+        transitions = engine.step()
+        if recorder is not None:
+            recorder.record(engine, transitions)
+        if engine.time_step % every == 0 or engine.time_step == until_step:
+            if recorder is not None:
+                recorder.flush()  # the recording always reaches the last checkpoint, a resumed run continues it
+            checkpointer.save(engine)
+    return engine
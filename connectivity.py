@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class DisjointSet:
+    """Disjoint-set forest over agent ids with batched union and find.
+
+    parent[x] <= x always holds (roots are hooked under the smaller root), so the
+    forest can be flattened by pointer jumping on the whole parent array at once.
+    """
+
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def compress(self):
+        """Point every node straight at its root (full path compression)"""
+        while True:
+            grandparent = self.parent[self.parent]
+            if np.array_equal(grandparent, self.parent):
+                return
+            self.parent = grandparent
+
+    def find(self, items):
+        self.compress()
+        return self.parent[items]
+
+    def union(self, u, v):
+        """Merge the sets of every pair (u[k], v[k])"""
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        while len(u):
+            ru, rv = self.find(u), self.find(v)
+            differ = ru != rv
+            u, v, ru, rv = u[differ], v[differ], ru[differ], rv[differ]
+            # hook the larger root under the smallest root it has to join this round
+            np.minimum.at(self.parent, np.maximum(ru, rv), np.minimum(ru, rv))
+
+    def labels(self):
+        """Root of every node, equal roots mean the same component"""
+        self.compress()
+        return self.parent
+
+
+def component_stats(labels):
+    sizes = np.bincount(labels, minlength=len(labels))
+    sizes = sizes[sizes > 0]
+    return {
+        "num_components": len(sizes),
+        "largest_component": int(sizes.max()) if len(sizes) else 0,
+        "isolated_nodes": int(np.count_nonzero(sizes == 1)),
+        "mean_component_size": float(sizes.mean()) if len(sizes) else 0.0,
+    }
+
+
+def bridge_components(num_nodes, u, v, rng):
+    """Edges that connect every component of the graph (num_nodes, edge list u-v) to the largest one.
+
+    One bridge per extra component, from a random member of that component to a random
+    member of the largest component. Returns (bridge_u, bridge_v, stats) where stats
+    describes the components before bridging.
+    """
+    forest = DisjointSet(num_nodes)
+    forest.union(u, v)
+    labels = forest.labels()
+    stats = component_stats(labels)
+    stats["bridges_added"] = stats["num_components"] - 1 if num_nodes else 0
+    if stats["num_components"] <= 1:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, stats
+
+    main = np.argmax(np.bincount(labels, minlength=num_nodes))
+    # first node of every component in a random order is a random member of it
+    shuffled = rng.permutation(num_nodes)
+    roots, first = np.unique(labels[shuffled], return_index=True)
+    members = shuffled[first[roots != main]]
+    targets = rng.choice(np.flatnonzero(labels == main), len(members))
+    return members, targets, stats
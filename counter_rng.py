@@ -0,0 +1,74 @@
+import numpy as np
+
+# Counter-based random numbers (Philox4x32-10, Salmon et al. 2011, "Parallel random numbers:
+# as easy as 1, 2, 3"). A draw is a pure function of (seed, step, agent, purpose, index),
+# so it does not matter in which order, in which batch or in which process it is made.
+# That is what lets the serial, vectorized and sharded engines produce identical runs.
+
+PHILOX_M0, PHILOX_M1 = 0xD2511F53, 0xCD9E8D57
+PHILOX_W0, PHILOX_W1 = 0x9E3779B9, 0xBB67AE85
+MASK32 = 0xFFFFFFFF
+
+# what a draw is used for, the third counter word
+CONTACT, TRANSMIT, MORTALITY, INITIAL = 1, 2, 3, 4
+
+
+def seed_key(seed):
+    """The two 32 bit key words of a (up to 64 bit) seed"""
+    seed = int(seed)
+    if not 0 <= seed < 2 ** 64:
+        raise ValueError(f"seed must be in [0, 2**64), got {seed}")
+    return seed & MASK32, seed >> 32
+
+
+def philox4x32(counter, key, rounds=10):
+    """Philox4x32 of every row of counter ((n, 4) uint32) under key (two words), returns (n, 4) uint32"""
+    c = [np.asarray(counter[:, i], dtype=np.uint64) for i in range(4)]
+    k0, k1 = (int(word) for word in key)
+    m0, m1, mask = np.uint64(PHILOX_M0), np.uint64(PHILOX_M1), np.uint64(MASK32)
+    for i in range(rounds):
+        if i:
+            k0, k1 = (k0 + PHILOX_W0) & MASK32, (k1 + PHILOX_W1) & MASK32
+        p0 = m0 * c[0]
+        p1 = m1 * c[2]
+        c = [(p1 >> np.uint64(32)) ^ c[1] ^ np.uint64(k0), p1 & mask,
+             (p0 >> np.uint64(32)) ^ c[3] ^ np.uint64(k1), p0 & mask]
+    return np.stack(c, axis=1).astype(np.uint32)
+
+
+def philox4x32_scalar(counter, key, rounds=10):
+    """Plain Python Philox4x32 of one counter (four ints), the reference for philox4x32"""
+    c0, c1, c2, c3 = counter
+    k0, k1 = key
+    for i in range(rounds):
+        if i:
+            k0, k1 = (k0 + PHILOX_W0) & MASK32, (k1 + PHILOX_W1) & MASK32
+        p0 = PHILOX_M0 * c0
+        p1 = PHILOX_M1 * c2
+        c0, c1, c2, c3 = (p1 >> 32) ^ c1 ^ k0, p1 & MASK32, (p0 >> 32) ^ c3 ^ k1, p0 & MASK32
+    return c0, c1, c2, c3
+
+
+def uniforms(seed, step, agents, purpose, index=0):
+    """One float64 in [0, 1) per agent (and index, broadcast against agents) for this step and purpose"""
+    agents, index = np.broadcast_arrays(np.asarray(agents, dtype=np.int64), np.asarray(index, dtype=np.int64))
+    counter = np.empty((agents.size, 4), dtype=np.uint32)
+    counter[:, 0] = agents.ravel()
+    counter[:, 1] = step
+    counter[:, 2] = purpose
+    counter[:, 3] = index.ravel()
+    words = philox4x32(counter, seed_key(seed)).astype(np.uint64)
+    bits = ((words[:, 0] << np.uint64(32)) | words[:, 1]) >> np.uint64(11)  # 53 random bits
+    return (bits.astype(np.float64) * 2.0 ** -53).reshape(agents.shape)
+
+
+def uniform(seed, step, agent, purpose, index=0):
+    """Scalar uniforms(), computed with the pure Python Philox"""
+    w0, w1, _, _ = philox4x32_scalar((agent & MASK32, step & MASK32, purpose, index & MASK32), seed_key(seed))
+    return (((w0 << 32) | w1) >> 11) * 2.0 ** -53
+
+
+def initial_infections(seed, size, count):
+    """Sorted ids of the count agents to infect at the start: the ones with the smallest draws"""
+    draws = uniforms(seed, 0, np.arange(size), INITIAL)
+    return np.sort(np.argsort(draws, kind="stable")[:count])
@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+import numpy as np
+import counter_rng
+import snapshot
+from recorder import Recorder
+from population import AgentPopulation
+from shared_arrays import attach_arrays, share_arrays
+from step_engine import FrontierStepEngine, KeyedStepEngine, StepEngine
+
+# Same defaults as run_visualization
+DEFAULT_PARAMS = {
+    "initial_infection_rate": 0.05,
+    "mortality_rate": 0.05,
+    "base_prob": 0.15,
+}
+# params may also hold "update" (see step_engine.UPDATE_MODES), without it every engine
+# keeps its own default: sweep, synchronous for the sharded engine
+
+# Set in every pool worker by _attach_population, the population lives in shared memory
+_worker_shm = None
+_worker_population = None
+
+
+def start_engine(population, rng, params=None, engine_class=FrontierStepEngine, **engine_args):
+    """Engine on population with the initial infections of params already seeded.
+    engine_class can be any engine taking an rng, e.g. gillespie_engine.GillespieEngine."""
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    if "update" in params and issubclass(engine_class, StepEngine):
+        engine_args = dict(engine_args, update=params["update"])  # continuous time has no steps to sweep
+    engine = engine_class(population, rng=rng,
+                          mortality_rate=params["mortality_rate"], base_prob=params["base_prob"], **engine_args)
+    num_initial_infected = int(len(population) * params["initial_infection_rate"])
+    engine.infect(rng.choice(len(population), num_initial_infected, replace=False), 0)
+    return engine
+
+
+def start_keyed_engine(population, seed, params=None, engine_class=KeyedStepEngine, **engine_args):
+    """Counter-based engine (KeyedStepEngine, SerialStepEngine or ShardedStepEngine) with its
+    initial infections, which are also drawn from the counter-based generator"""
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    if "update" in params:
+        engine_args = dict(engine_args, update=params["update"])
+    engine = engine_class(population, seed=seed, mortality_rate=params["mortality_rate"], base_prob=params["base_prob"],
+                          **engine_args)
+    num_initial_infected = int(len(population) * params["initial_infection_rate"])
+    engine.infect(counter_rng.initial_infections(seed, len(population), num_initial_infected), 0)
+    return engine
+
+
+def run_replicate(population, steps, seed, params=None, record_dir=None):
+    """One stochastic run of the model, returns an array of (S, I, R, D) counts per step (steps + 1 rows).
+
+    With record_dir the full per-step aggregates (recorder.Recorder) are streamed there as well.
+    """
+    engine = start_engine(population.fresh_copy(), np.random.default_rng(seed), params)
+    recorder = Recorder(record_dir, engine) if record_dir is not None else None
+
+    history = np.empty((steps + 1, 4), dtype=np.int64)
+    history[0] = list(engine.status_counts.values())
+    for step in range(1, steps + 1):
+        transitions = engine.step()
+        history[step] = list(engine.status_counts.values())
+        if recorder is not None:
+            recorder.record(engine, transitions)
+    if recorder is not None:
+        recorder.close()
+    return history
+
+
+def _attach_population(spec):
+    global _worker_shm, _worker_population
+    _worker_shm, columns = attach_arrays(spec)
+    _worker_population = AgentPopulation.from_columns(columns)
+
+
+def _load_population(path):
+    global _worker_population
+    _worker_population = snapshot.load_population(path)
+
+
+def _run_in_worker(args):
+    index, steps, seed, params, record_dir = args
+    return index, run_replicate(_worker_population, steps, seed, params, record_dir)
+
+
+def _replicate_dir(record_dir, index):
+    return None if record_dir is None else os.path.join(record_dir, f"run-{index:05d}")
+
+
+class EnsembleResult:
+    """Aggregated S/I/R/D curves of a set of replicates.
+
+    curves has shape (runs, steps + 1, 4) with the columns in "SIRD" order, mean and
+    every entry of quantiles have shape (steps + 1, 4).
+    """
+    columns = "SIRD"
+
+    def __init__(self, curves, quantiles=(0.05, 0.5, 0.95)):
+        self.curves = curves
+        self.time = np.arange(curves.shape[1])
+        self.mean = curves.mean(axis=0)
+        self.quantiles = {q: np.quantile(curves, q, axis=0) for q in quantiles}
+        infected = curves[:, :, self.columns.index("I")]
+        self.peak_time = infected.argmax(axis=1)
+        self.peak_infected = infected.max(axis=1)
+
+    def curve(self, status, stat="mean"):
+        """One status column of the mean curve or of a quantile, e.g. curve("I", 0.95)"""
+        table = self.mean if stat == "mean" else self.quantiles[stat]
+        return table[:, self.columns.index(status)]
+
+    def peak_time_quantiles(self, quantiles=(0.05, 0.5, 0.95)):
+        return {q: float(np.quantile(self.peak_time, q)) for q in quantiles}
+
+
+def run_ensemble(population, num_runs, steps, seed=None, params=None, workers=None,
+                 quantiles=(0.05, 0.5, 0.95), record_dir=None):
+    """Run num_runs independent replicates of the model on population across a process pool.
+
+    Every replicate gets its own RNG stream spawned from seed, so results only depend on
+    seed and not on the number of workers. The static population columns are copied into
+    shared memory once (or memory mapped from the snapshot the population was loaded from)
+    and every worker attaches to them, nothing is pickled per replicate. With record_dir
+    every replicate streams its per-step aggregates into record_dir/run-<index>.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(num_runs)
+    workers = min(workers or os.cpu_count() or 1, num_runs)
+    curves = np.empty((num_runs, steps + 1, 4), dtype=np.int64)
+
+    if workers <= 1:
+        for index, run_seed in enumerate(seeds):
+            curves[index] = run_replicate(population, steps, run_seed, params, _replicate_dir(record_dir, index))
+        return EnsembleResult(curves, quantiles)
+
+    # a population loaded from a snapshot is already shareable, workers map the same file
+    if population.snapshot_path is not None:
+        shm = None
+        initializer, initargs = _load_population, (population.snapshot_path,)
+    else:
+        shm, spec = share_arrays(population.static_columns())
+        initializer, initargs = _attach_population, (spec,)
+    try:
+        with multiprocessing.Pool(workers, initializer=initializer, initargs=initargs) as pool:
+            jobs = [(index, steps, run_seed, params, _replicate_dir(record_dir, index))
+                    for index, run_seed in enumerate(seeds)]
+            for index, history in pool.imap_unordered(_run_in_worker, jobs):
+                curves[index] = history
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+    return EnsembleResult(curves, quantiles)
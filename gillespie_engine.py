@@ -0,0 +1,250 @@
+import numpy as np
+import agent
+import profiling
+from agent import SUSCEPTIBLE, INFECTED, RECOVERED, DEAD
+
+# Continuous-time version of the model, simulated with the next-reaction method
+# (Gibson & Bruck 2000): every pending event has an absolute time in an indexed priority
+# queue and the simulation jumps from one event to the next, so quiet periods cost nothing.
+#
+# Rates are chosen so one day of continuous time matches one step of StepEngine: an
+# infected agent i meets a given neighbour on a day with probability k_i / deg_i
+# (k_i = int(deg_i * mobility_i) contacts a day) and a meeting transmits with the usual
+# base_prob * transmit_i * receive_j, so the edge i -> j fires at rate -ln(1 - q_ij) with
+# q_ij the product of the two. Infections last recovery_time days and then end in death
+# (mortality_rate) or recovery.
+#
+# Edge events are folded into their target: a susceptible agent only needs the earliest
+# transmission time over its infected neighbours, so it sits in the queue once and a new
+# infected neighbour can only move that time forward (decrease-key). An infected agent
+# sits in the queue with its recovery time. The queue never holds more than n entries.
+
+
+class IndexedPriorityQueue:
+    """Binary min-heap of (time, item) with at most one entry per item (0 <= item < size)
+    and O(log n) push / decrease-key / pop by item"""
+
+    def __init__(self, size):
+        self.heap = []  # items
+        self.time = []  # times, parallel to heap
+        self.position = [-1] * size  # where each item is in the heap, -1 when it is not
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, item):
+        return self.position[item] >= 0
+
+    def peek_time(self):
+        return self.time[0] if self.heap else float("inf")
+
+    def key(self, item):
+        position = self.position[item]
+        return self.time[position] if position >= 0 else float("inf")
+
+    def push(self, item, time):
+        """Add item, or move it to time if it is already queued"""
+        position = self.position[item]
+        if position < 0:
+            self.heap.append(item)
+            self.time.append(time)
+            self.position[item] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+        elif time < self.time[position]:
+            self.time[position] = time
+            self._sift_up(position)
+        else:
+            self.time[position] = time
+            self._sift_down(position)
+
+    def decrease(self, item, time):
+        """Queue item at time unless it is already queued at an earlier time"""
+        position = self.position[item]
+        if position < 0 or time < self.time[position]:
+            self.push(item, time)
+
+    def pop(self):
+        """Remove the earliest entry, returns (time, item)"""
+        item, time = self.heap[0], self.time[0]
+        self._remove_at(0)
+        return time, item
+
+    def remove(self, item):
+        position = self.position[item]
+        if position >= 0:
+            self._remove_at(position)
+
+    def _remove_at(self, position):
+        self.position[self.heap[position]] = -1
+        last_item, last_time = self.heap.pop(), self.time.pop()
+        if position < len(self.heap):
+            self.heap[position], self.time[position] = last_item, last_time
+            self.position[last_item] = position
+            self._sift_up(position)
+            self._sift_down(self.position[last_item])
+
+    def _sift_up(self, position):
+        heap, times, where = self.heap, self.time, self.position
+        item, time = heap[position], times[position]
+        while position > 0:
+            parent = (position - 1) >> 1
+            if times[parent] <= time:
+                break
+            heap[position], times[position] = heap[parent], times[parent]
+            where[heap[position]] = position
+            position = parent
+        heap[position], times[position] = item, time
+        where[item] = position
+
+    def _sift_down(self, position):
+        heap, times, where = self.heap, self.time, self.position
+        size = len(heap)
+        item, time = heap[position], times[position]
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and times[child + 1] < times[child]:
+                child += 1
+            if times[child] >= time:
+                break
+            heap[position], times[position] = heap[child], times[child]
+            where[heap[position]] = position
+            position = child
+        heap[position], times[position] = item, time
+        where[item] = position
+
+
+def resample(event_times, counts, grid):
+    """Counts of a piecewise constant trajectory on a time grid.
+
+    counts[k] holds from event_times[k] until the next event, so every grid point gets the
+    row of the last event at or before it. Returns an array of shape (len(grid), columns).
+    """
+    rows = np.searchsorted(np.asarray(event_times), np.asarray(grid), side="right") - 1
+    return np.asarray(counts)[np.maximum(rows, 0)]
+
+
+class GillespieEngine:
+    """Continuous-time engine with the interface of StepEngine.
+
+    step() runs every event up to the next whole day, so time_step, history and the
+    returned (new_infections, recovered, dead) are on the same daily grid as the step
+    engines and work with the simulation worker, the recorder and the plots unchanged.
+    last_infected_timestep holds the day of infection (rounded down), infection_time the
+    exact time. With record_events every event's time and counts are kept as well
+    (event_times, event_counts), see resample().
+    """
+
+    def __init__(self, population, mortality_rate=0.05, base_prob=agent.BASE_TRANSMISSION_PROB, rng=None,
+                 age_bands=agent.AGE_BANDS, record_events=False):
+        self.population = population
+        self.indptr = population.indptr
+        self.indices = population.indices
+        self.n = len(population)
+        self.age = population.age
+        self.immunity = population.immunity
+        self.mobility = population.mobility
+        self.recovery_time = population.recovery_time
+        self.status = population.status
+        self.last_infected_timestep = population.last_infected_timestep
+        self.mortality_rate = mortality_rate
+        self.base_prob = base_prob
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.degree = population.degree
+        self.time = 0.0
+        self.time_step = 0
+        counts = np.bincount(self.status, minlength=len(agent.STATUS_NAMES))
+        self.status_counts = {name: int(c) for name, c in zip(agent.STATUS_NAMES, counts)}
+        self.history = []
+        self.events = 0
+
+        self.age_bands = age_bands
+        self.transmit_factor, self.receive_factor = agent.transmission_factors(self.age, self.immunity, age_bands)
+        # chance that an infected agent meets a given neighbour on a day
+        contacts = (self.degree * self.mobility.astype(np.float64)).astype(np.int64)
+        self.meet_prob = np.divide(contacts, self.degree, out=np.zeros(self.n), where=self.degree > 0)
+
+        self.infection_time = np.full(self.n, np.nan)
+        self.queue = IndexedPriorityQueue(self.n)
+        self.record_events = record_events
+        self.event_times, self.event_counts = [0.0], [tuple(self.status_counts.values())]
+
+    def set_immunity(self, ids, immunity):
+        """Change the immunity of some agents, their receive factors are recomputed (pending
+        transmissions to them keep their times)"""
+        self.immunity[ids] = immunity
+        self.receive_factor[ids] = agent.transmission_factors(self.age[ids], self.immunity[ids], self.age_bands)[1]
+
+    def infect(self, ids, timestep=None):
+        """Infect the given susceptible agents at time timestep (defaults to the current time)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[self.status[ids] == SUSCEPTIBLE]
+        time = self.time if timestep is None else float(timestep)
+        for i in ids.tolist():
+            self._infect(i, time)
+        return ids
+
+    def _infect(self, i, time):
+        self.status[i] = INFECTED
+        self.infection_time[i] = time
+        self.last_infected_timestep[i] = int(time)
+        self.status_counts["S"] -= 1
+        self.status_counts["I"] += 1
+        end = time + int(self.recovery_time[i])
+        self.queue.push(i, end)
+
+        # one exponential waiting time per susceptible neighbour, only the ones that
+        # fire before i stops being infectious and beat the neighbour's current time matter
+        neighbours = self.indices[self.indptr[i]:self.indptr[i + 1]]
+        neighbours = neighbours[self.status[neighbours] == SUSCEPTIBLE]
+        q = self.meet_prob[i] * self.base_prob * self.transmit_factor[i] * self.receive_factor[neighbours]
+        neighbours, q = neighbours[q > 0], q[q > 0]
+        if len(neighbours) == 0:
+            return
+        times = time + self.rng.exponential(size=len(neighbours)) / -np.log1p(-q)
+        hit = times < end
+        for j, t in zip(neighbours[hit].tolist(), times[hit].tolist()):
+            self.queue.decrease(j, t)
+
+    def run_until(self, until, transitions=None):
+        """Handle every event up to time until. transitions, if given, is a tuple of three
+        lists the new infections, recoveries and deaths are appended to."""
+        queue, status = self.queue, self.status
+        while queue.peek_time() <= until:
+            time, i = queue.pop()
+            self.time = time
+            self.events += 1
+            if status[i] == SUSCEPTIBLE:
+                self._infect(i, time)
+                kind = 0
+            elif self.rng.random() < self.mortality_rate:
+                status[i] = DEAD
+                self.status_counts["I"] -= 1
+                self.status_counts["D"] += 1
+                kind = 2
+            else:
+                status[i] = RECOVERED
+                self.status_counts["I"] -= 1
+                self.status_counts["R"] += 1
+                kind = 1
+            if transitions is not None:
+                transitions[kind].append(i)
+            if self.record_events:
+                self.event_times.append(time)
+                self.event_counts.append(tuple(self.status_counts.values()))
+        self.time = max(self.time, until)
+
+    def step(self):
+        """Advance to the next whole day, returns (new_infections, recovered, dead) of that day"""
+        lap = profiling.laps("step")
+        transitions = ([], [], [])
+        self.run_until(self.time_step + 1, transitions)
+        lap("events")
+        self.time_step += 1
+        self.history.append(tuple(self.status_counts.values()))
+        return tuple(np.array(ids, dtype=np.int64) for ids in transitions)
+
+    def status_of(self, agent_id):
+        return agent.STATUS_NAMES[self.status[agent_id]]
@@ -1,162 +1,140 @@
-import agent
-import random
+import numpy as np
+import connectivity
+import profiling
+from population import AgentPopulation
 
-def create_graph():
-    total_population = int(input("Please enter the total number of people: "))
-    num_of_agents_in_cluster = 20
+# Every ordered pair inside a cluster used to get its own 10% draw, so an unordered pair ends up linked with this probability
+INTRA_CLUSTER_EDGE_PROB = 1 - (1 - 0.10) ** 2
+INTER_CLUSTER_AGENT_PROB = 0.2  # prob of having edge outside of cluster is 20%
+INTER_CLUSTER_EDGE_PROB = 0.05  # prob of having edge with every node in the selected cluster is 5%
+SUPERSPREADER_PROB = 0.001  # prob of having a superspreader in the population is 0.1%
+SUPERSPREADER_EDGE_PROB = 0.03  # superspreaders have 3% chance of having an edge with any other node
+SUPERSPREADER_MAX_CONNECTIONS = 20  # maximum number of people that the superspreader can connect to
+
+
+def bernoulli_trials(rng, num_trials, p):
+    """Indices of the successes among num_trials independent trials with probability p.
+
+    Uses geometric skip sampling, so the cost is proportional to the number of
+    successes and not to the number of trials.
+    """
+    if num_trials <= 0 or p <= 0:
+        return np.empty(0, dtype=np.int64)
+    if p >= 1:
+        return np.arange(num_trials, dtype=np.int64)
+    chunks = []
+    position = -1
+    while True:
+        batch = int((num_trials - position) * p * 1.1) + 16
+        hits = position + np.cumsum(rng.geometric(p, size=batch))
+        chunks.append(hits[hits < num_trials])
+        if hits[-1] >= num_trials:
+            return np.concatenate(chunks)
+        position = hits[-1]
+
+
+def cluster_pair_edges(rng, start, num_clusters, cluster_size, p):
+    """Edges inside num_clusters consecutive clusters of cluster_size agents, starting at agent start"""
+    pair_a, pair_b = np.triu_indices(cluster_size, 1)
+    if len(pair_a) == 0:
+        return pair_a, pair_b
+    # all unordered pairs of all clusters are one long sequence of trials
+    cluster, pair = np.divmod(bernoulli_trials(rng, num_clusters * len(pair_a), p), len(pair_a))
+    base = start + cluster * cluster_size
+    return base + pair_a[pair], base + pair_b[pair]
+
+
+def create_graph(total_population, num_of_agents_in_cluster=20, seed=None):
+    lap = profiling.laps("generate")
+    rng = np.random.default_rng(seed)
+    agents = AgentPopulation(total_population)
+    agents.generator_params = {"total_population": total_population,
+                               "num_of_agents_in_cluster": num_of_agents_in_cluster, "seed": seed}
+    if total_population == 0:
+        return agents
 
-    agents = {}
     full_clusters = total_population // num_of_agents_in_cluster
     remainder = total_population % num_of_agents_in_cluster
+    actual_clusters = full_clusters + (1 if remainder > 0 else 0)
+
+    agents.mobility[:] = rng.uniform(0.3, 1, total_population)
+    agents.immunity[:] = rng.uniform(0.1, 0.6, total_population)
+    agents.age[:] = rng.integers(0, 101, total_population)
+    agents.recovery_time[:] = rng.integers(10, 17, total_population)  # Random recovery time between 10-16 days
+    # remainder agents end up in the final cluster
+    agents.cluster[:] = agents.id // num_of_agents_in_cluster
+    lap("attributes")
+
+    edges_u, edges_v = [], []
 
     #creating clusters (nodes inside clusters have a lot of edges among them since they interact with each other a lot)
-    for j in range(full_clusters):
-        for i in range(num_of_agents_in_cluster * j, j * num_of_agents_in_cluster + num_of_agents_in_cluster):
-            mobility = random.uniform(0.3,1)
-            immunity = random.uniform(0.1, 0.6)
-            age = random.randint(0,100)
-            agents[i] = agent.Agent(i,age,immunity,mobility,j)
-        for k in range(num_of_agents_in_cluster * j, j * num_of_agents_in_cluster + num_of_agents_in_cluster):
-            for x in range(num_of_agents_in_cluster * j, j * num_of_agents_in_cluster + num_of_agents_in_cluster):
-                if k != x:
-                    if random.random() <= 0.10: #prob of having an edge inside cluster is 10%
-                        agents[k].neighbours.add(x)
-                        agents[x].neighbours.add(k)
-    
+    u, v = cluster_pair_edges(rng, 0, full_clusters, num_of_agents_in_cluster, INTRA_CLUSTER_EDGE_PROB)
+    edges_u.append(u)
+    edges_v.append(v)
+
     # Handle remainder agents - assign them to the final cluster
     if remainder > 0:
-        final_cluster = full_clusters
         start_idx = full_clusters * num_of_agents_in_cluster
-        
-        # Create remainder agents
-        for i in range(start_idx, total_population):
-            mobility = random.uniform(0.3,1)
-            immunity = random.uniform(0.1, 0.6)
-            age = random.randint(0,100)
-            agents[i] = agent.Agent(i,age,immunity,mobility,final_cluster)
-        
-        # Connect remainder agents within their cluster
-        for k in range(start_idx, total_population):
-            for x in range(start_idx, total_population):
-                if k != x:
-                    if random.random() <= 0.10: #prob of having an edge inside cluster is 10%
-                        agents[k].neighbours.add(x)
-                        agents[x].neighbours.add(k)
-        
-        # Ensure remainder agents connect to the main network
+        u, v = cluster_pair_edges(rng, start_idx, 1, remainder, INTRA_CLUSTER_EDGE_PROB)
+        edges_u.append(u)
+        edges_v.append(v)
+
+        # Connect the remainder cluster to at least one other cluster
         if full_clusters > 0:
-            # Connect the remainder cluster to at least one other cluster
-            random_agent_from_remainder = random.randint(start_idx, total_population-1)
-            random_cluster = random.randint(0, full_clusters-1)
-            random_agent_from_other = random.randint(random_cluster*num_of_agents_in_cluster, 
-                                                    (random_cluster+1)*num_of_agents_in_cluster-1)
-            
-            agents[random_agent_from_remainder].neighbours.add(random_agent_from_other)
-            agents[random_agent_from_other].neighbours.add(random_agent_from_remainder)
-
-    #creating edges among clusters 
-    superspreaders= []
-    actual_clusters = full_clusters + (1 if remainder > 0 else 0)
-    
-    for j in range(actual_clusters):
-        cluster_start = j * num_of_agents_in_cluster
-        cluster_end = min(total_population, (j+1) * num_of_agents_in_cluster)
-        
-        for i in range(cluster_start, cluster_end):
-            if random.random() <= 0.2: #prob of having edge outside of cluster is 20%
-                # Pick a different cluster
-                random_num = random.randint(0, actual_clusters-1)
-                while random_num == j:
-                    random_num = random.randint(0, actual_clusters-1)
-                
-                target_start = random_num * num_of_agents_in_cluster
-                target_end = min(total_population, (random_num+1) * num_of_agents_in_cluster)
-                
-                for k in range(target_start, target_end):
-                    prob = random.random()
-                    if prob < 0.05: #prob of having edge outside of cluster with every node in the selected cluster is 5%
-                        agents[i].neighbours.add(k)
-                        agents[k].neighbours.add(i)
-
-    for i in range(total_population):
-        random_num = random.random()
-        if random_num < 0.001: #prob of having a superspreader in the population is 0.1%
-            superspreaders.append(i)
-
-    for i in superspreaders:
-        max_connection_limit = 20
-        current_connection_count = 0
-        for j in range(total_population):
-            if i != j and random.random() <= 0.03: #superspreaders have 3% chance of having an edge with any other node
-                if(current_connection_count >= max_connection_limit): #20 is the maximum number of people that the superspreader can connect to
-                    break
-                agents[i].neighbours.add(j)
-                agents[j].neighbours.add(i)
-                current_connection_count += 1
+            edges_u.append(rng.integers(start_idx, total_population, 1))
+            edges_v.append(rng.integers(0, start_idx, 1))
+    lap("intra_cluster")
+
+    #creating edges among clusters
+    if actual_clusters > 1:
+        reaching = bernoulli_trials(rng, total_population, INTER_CLUSTER_AGENT_PROB)
+        # Pick a different cluster uniformly
+        target = rng.integers(0, actual_clusters - 1, len(reaching))
+        target += target >= agents.cluster[reaching]
+        target_start = target * num_of_agents_in_cluster
+        target_size = np.minimum(total_population, target_start + num_of_agents_in_cluster) - target_start
+
+        # one trial per (reaching agent, slot in the target cluster), slots past the end of a short cluster are dropped
+        who, slot = np.divmod(bernoulli_trials(rng, len(reaching) * num_of_agents_in_cluster,
+                                               INTER_CLUSTER_EDGE_PROB), num_of_agents_in_cluster)
+        keep = slot < target_size[who]
+        edges_u.append(reaching[who[keep]])
+        edges_v.append(target_start[who[keep]] + slot[keep])
+    lap("inter_cluster")
+
+    # Superspreaders link to the first successes of a 3% trial against every other node in id order,
+    # so only the gaps up to the connection limit have to be drawn
+    superspreaders = bernoulli_trials(rng, total_population, SUPERSPREADER_PROB)
+    if len(superspreaders) and total_population > 1:
+        gaps = rng.geometric(SUPERSPREADER_EDGE_PROB, size=(len(superspreaders), SUPERSPREADER_MAX_CONNECTIONS))
+        others = np.cumsum(gaps, axis=1) - 1
+        valid = others < total_population - 1
+        targets = others + (others >= superspreaders[:, None])  # skip the superspreader itself
+        edges_u.append(np.broadcast_to(superspreaders[:, None], targets.shape)[valid])
+        edges_v.append(targets[valid])
+    lap("superspreaders")
 
     # Ensure no isolated agents
-    for i in range(total_population):
-        if len(agents[i].neighbours) == 0:
-            # Find this agent's cluster
-            cluster_id = agents[i].cluster
-            cluster_start = cluster_id * num_of_agents_in_cluster
-            cluster_end = min(total_population, (cluster_id+1) * num_of_agents_in_cluster)
-            
-            # If no neighbors in own cluster, connect to a random agent
-            potential_neighbors = list(range(cluster_start, cluster_end))
-            potential_neighbors.remove(i)  # Don't connect to self
-            
-            if potential_neighbors:
-                # Connect to someone in the same cluster
-                random_neighbor = random.choice(potential_neighbors)
-                agents[i].neighbours.add(random_neighbor)
-                agents[random_neighbor].neighbours.add(i)
-            else:
-                # If somehow still no neighbors, connect to any random agent
-                random_neighbor = random.randint(0, total_population-1)
-                while random_neighbor == i:
-                    random_neighbor = random.randint(0, total_population-1)
-                agents[i].neighbours.add(random_neighbor)
-                agents[random_neighbor].neighbours.add(i)
-    
-    # Final check to ensure the graph is connected
-    # Build adjacency list for a simple connectivity check
-    adj_list = {i: [] for i in range(total_population)}
-    for i in range(total_population):
-        for neighbor in agents[i].neighbours:
-            adj_list[i].append(neighbor)
-    
-    # Iterative DFS to check connectivity (avoids recursion error)
-    visited = [False] * total_population
-    
-    def check_connectivity():
-        if total_population == 0:
-            return
-            
-        stack = [0]  # Start from first node
-        visited[0] = True
-        
-        while stack:
-            current = stack.pop()
-            for neighbor in adj_list[current]:
-                if not visited[neighbor]:
-                    visited[neighbor] = True
-                    stack.append(neighbor)
-    
-    check_connectivity()  # Run the connectivity check
-    
-    # If there are still unvisited nodes, connect them to the main component
-    for i in range(total_population):
-        if not visited[i]:
-            # Connect to any visited node
-            connected_nodes = [j for j in range(total_population) if visited[j]]
-            if connected_nodes:  # Check if there are any connected nodes
-                random_visited = random.choice(connected_nodes)
-                agents[i].neighbours.add(random_visited)
-                agents[random_visited].neighbours.add(i)
-                # Mark as visited
-                visited[i] = True
+    degree = sum(np.bincount(e, minlength=total_population) for e in edges_u + edges_v)
+    isolated = np.flatnonzero(degree == 0)
+    if len(isolated) and total_population > 1:
+        cluster_start = agents.cluster[isolated].astype(np.int64) * num_of_agents_in_cluster
+        cluster_size = np.minimum(total_population, cluster_start + num_of_agents_in_cluster) - cluster_start
+        # Connect to someone in the same cluster, or to any random agent if the cluster is just this one agent
+        size = np.where(cluster_size > 1, cluster_size, total_population)
+        start = np.where(cluster_size > 1, cluster_start, 0)
+        offset = rng.integers(1, size)
+        edges_u.append(isolated)
+        edges_v.append(start + (isolated - start + offset) % size)
+    lap("isolated")
+
+    # Final check to ensure the graph is connected: one bridge from every extra component to the largest one
+    u = np.concatenate(edges_u)
+    v = np.concatenate(edges_v)
+    bridge_u, bridge_v, agents.connectivity_stats = connectivity.bridge_components(total_population, u, v, rng)
+    lap("bridges")
+
+    agents.set_edges(np.concatenate((u, bridge_u)), np.concatenate((v, bridge_v)))
+    lap("csr")
 
     return agents
-    # for i in agents.keys():
-    #     print(agents[i].id, agents[i].neighbours)
\ No newline at end of file
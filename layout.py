@@ -0,0 +1,123 @@
+import hashlib
+import os
+import numpy as np
+
+# Bump when the layout algorithm changes so cached layouts are recomputed
+LAYOUT_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "infection-spread-simulation", "layouts")
+GOLDEN_ANGLE = np.pi * (3 - np.sqrt(5))
+
+
+def sunflower(count):
+    """count points spread evenly over the unit disc (Vogel's phyllotaxis spiral)"""
+    k = np.arange(count, dtype=np.float64)
+    radius = np.sqrt((k + 0.5) / max(count, 1))
+    return np.column_stack((radius * np.cos(k * GOLDEN_ANGLE), radius * np.sin(k * GOLDEN_ANGLE)))
+
+
+def cluster_graph(population):
+    """Edges between clusters (both directions, with duplicates) as two arrays of cluster ids"""
+    u, v = population.edges()
+    cu, cv = population.cluster[u], population.cluster[v]
+    between = cu != cv
+    cu, cv = cu[between], cv[between]
+    return np.concatenate((cu, cv)), np.concatenate((cv, cu))
+
+
+def centroid_layout(num_clusters, cu, cv, iterations=30, pull=0.35):
+    """Positions for the cluster centroids.
+
+    Clusters are put on a sunflower spiral in breadth-first order of the cluster graph,
+    so linked clusters start out close, then a few rounds of anchored Laplacian
+    smoothing pull every centroid towards the mean of the clusters it is linked to.
+    """
+    # breadth-first order over the cluster graph, stored as CSR
+    order_idx = np.argsort(cu, kind="stable")
+    targets = cv[order_idx]
+    indptr = np.zeros(num_clusters + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cu, minlength=num_clusters), out=indptr[1:])
+    seen = np.zeros(num_clusters, dtype=bool)
+    order = []
+    for start in range(num_clusters):
+        if seen[start]:
+            continue
+        seen[start] = True
+        frontier = np.array([start])
+        while len(frontier):
+            order.append(frontier)
+            starts, ends = indptr[frontier], indptr[frontier + 1]
+            lengths = ends - starts
+            slots = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            nxt = np.unique(targets[slots])
+            nxt = nxt[~seen[nxt]]
+            seen[nxt] = True
+            frontier = nxt
+    order = np.concatenate(order) if order else np.empty(0, dtype=np.int64)
+
+    anchor = np.empty((num_clusters, 2))
+    anchor[order] = sunflower(num_clusters)
+    pos = anchor.copy()
+    degree = np.bincount(cu, minlength=num_clusters).astype(np.float64)
+    linked = degree > 0
+    for _ in range(iterations):
+        total = np.zeros_like(pos)
+        np.add.at(total, cu, pos[cv])
+        mean = pos.copy()
+        mean[linked] = total[linked] / degree[linked, None]
+        pos = (1 - pull) * anchor + pull * mean
+    return pos
+
+
+def cluster_layout(population):
+    """World space (n, 2) positions in [0, 1]: cluster centroids first, then members around them"""
+    n = len(population)
+    if n == 0:
+        return np.zeros((0, 2))
+    cluster = population.cluster.astype(np.int64)
+    num_clusters = int(cluster.max()) + 1
+    sizes = np.bincount(cluster, minlength=num_clusters)
+
+    cu, cv = cluster_graph(population)
+    centroids = centroid_layout(num_clusters, cu, cv)
+
+    # members on a small sunflower around their centroid, best connected members in the middle
+    order = np.lexsort((-population.degree, cluster))
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    size = sizes[cluster]
+    radius = np.sqrt((rank + 0.5) / size)
+    angle = rank * GOLDEN_ANGLE
+    # a cluster disc gets about as much room as its share of the whole spiral
+    spread = 0.5 / np.sqrt(max(num_clusters, 1)) * np.sqrt(size / sizes.mean())
+    pos = centroids[cluster] + (spread * radius)[:, None] * np.column_stack((np.cos(angle), np.sin(angle)))
+
+    low, high = pos.min(axis=0), pos.max(axis=0)
+    return (pos - low) / np.where(high > low, high - low, 1)
+
+
+def graph_hash(population):
+    digest = hashlib.sha256(f"layout-v{LAYOUT_VERSION}".encode())
+    for array in (population.indptr, population.indices, population.cluster):
+        digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+def cached_layout(population, cache_dir=DEFAULT_CACHE_DIR):
+    """cluster_layout(population), read from / written to cache_dir keyed by a hash of the graph"""
+    path = os.path.join(cache_dir, graph_hash(population) + ".npy")
+    try:
+        positions = np.load(path)
+        if positions.shape == (len(population), 2):
+            return positions
+    except (FileNotFoundError, ValueError, OSError):
+        pass
+    positions = cluster_layout(population)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, positions)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # a read-only cache just means the layout is computed again next time
+    return positions
@@ -1,10 +1,198 @@
-# from spread_and_simulation import start_simulation as st
-from graphs_and_clustering import create_graph
-from simulation_loop import run_visualization
+import argparse
+import sys
+
+# Only argparse is imported up front, every command imports what it needs so headless
+# commands never load pygame or matplotlib.
+
+
+def load_or_generate(args):
+    """The population from --input (a snapshot) or a fresh graph of --population agents"""
+    if args.input:
+        import snapshot
+        return snapshot.load_population(args.input)
+    if not args.population:
+        sys.exit("Either --population or --input is required")
+    from graphs_and_clustering import create_graph
+    return create_graph(args.population, seed=args.seed)
+
+
+def print_counts(label, counts):
+    print(f"{label}: " + ", ".join(f"{name}={count}" for name, count in counts.items()))
+
+
+def cmd_generate(args):
+    import snapshot
+    population = load_or_generate(args)
+    snapshot.save_population(population, args.output)
+    stats = population.connectivity_stats
+    print(f"Wrote {len(population)} agents, {population.num_edges} edges to {args.output}")
+    if stats:
+        print(f"Components before bridging: {stats.get('num_components')}, bridges added: {stats.get('bridges_added')}")
+
+
+def cmd_run(args):
+    import numpy as np
+    import checkpoint
+    import ensemble
+    import profiling
+    from recorder import Recorder
+    if args.trace:
+        profiling.enable()
+    population = load_or_generate(args)
+    params = dict(ensemble.DEFAULT_PARAMS, mortality_rate=args.mortality_rate, base_prob=args.base_prob)
+    if args.update:
+        params["update"] = args.update
+
+    if args.engine == "sharded" and args.update == "sweep":
+        sys.exit("--update sweep is not supported with the sharded engine, it only steps synchronously")
+    if args.engine in ("sharded", "gillespie") and args.checkpoint_dir:
+        sys.exit(f"--checkpoint-dir is not supported with the {args.engine} engine")
+    checkpointer = None
+    engine = None
+    resumed = False
+    if args.checkpoint_dir:
+        try:
+            engine = checkpoint.restore(args.checkpoint_dir, population)
+            resumed = True
+            print(f"Resuming from step {engine.time_step}")
+        except checkpoint.CheckpointError:
+            pass
+        checkpointer = checkpoint.Checkpointer(args.checkpoint_dir)
+    if engine is None and args.engine == "frontier":
+        engine = ensemble.start_engine(population, np.random.default_rng(args.seed), params,
+                                       compact_dead_fraction=args.compact_dead_fraction)
+    elif engine is None and args.engine == "gillespie":
+        from gillespie_engine import GillespieEngine
+        engine = ensemble.start_engine(population, np.random.default_rng(args.seed), params, GillespieEngine)
+    elif engine is None and args.engine == "sharded":
+        from sharded_engine import ShardedStepEngine
+        engine = ensemble.start_keyed_engine(population, args.seed or 0, params, ShardedStepEngine,
+                                             workers=args.workers)
+    elif engine is None:
+        import step_engine
+        engine_class = step_engine.KeyedStepEngine if args.engine == "keyed" else step_engine.SerialStepEngine
+        engine = ensemble.start_keyed_engine(population, args.seed or 0, params, engine_class)
+
+    try:
+        # a resumed run continues its recording from the checkpoint's step
+        recorder = Recorder(args.output, engine, resume=resumed) if args.output else None
+        if checkpointer is not None:
+            checkpoint.run_with_checkpoints(engine, args.steps, checkpointer, every=args.checkpoint_every,
+                                            recorder=recorder)
+        else:
+            while engine.time_step < args.steps:
+                transitions = engine.step()
+                if recorder is not None:
+                    recorder.record(engine, transitions)
+        if recorder is not None:
+            recorder.close()
+    finally:
+        # the sharded engine's worker processes and shared memory go away on errors and Ctrl-C too
+        if args.engine == "sharded":
+            engine.close()
+    print_counts(f"Step {engine.time_step}", engine.status_counts)
+    if args.engine == "sharded":
+        timings = engine.timing_summary()
+        print(f"{timings['workers']} shards, per tick {timings['compute'] * 1000:.2f} ms compute, "
+              f"{timings['comm'] * 1000:.2f} ms communication ({timings['comm_fraction']:.0%}), "
+              f"{timings['boundary_events']} boundary infections")
+    elif args.engine == "gillespie":
+        print(f"{engine.events} events")
+    if args.trace:
+        print(f"Wrote {profiling.PROFILER.export_chrome_trace(args.trace)} trace events to {args.trace}")
+
+
+def cmd_gui(args):
+    import profiling
+    if args.profile or args.trace:
+        profiling.enable()  # before generating, so the generator phases are in the trace too
+    population = load_or_generate(args)
+    from simulation_loop import run_visualization
+    run_visualization(population, seed=args.seed, record_dir=args.output,
+                      profile=args.profile, trace_path=args.trace)
+
+
+def cmd_ensemble(args):
+    import numpy as np
+    import ensemble
+    population = load_or_generate(args)
+    params = {"mortality_rate": args.mortality_rate, "base_prob": args.base_prob, "update": args.update or "sweep"}
+    result = ensemble.run_ensemble(population, args.runs, args.steps, seed=args.seed, params=params,
+                                   workers=args.workers, record_dir=args.record_dir)
+    if args.output:
+        np.savez(args.output, curves=result.curves, mean=result.mean,
+                 **{f"quantile_{q}": table for q, table in result.quantiles.items()})
+    peaks = result.peak_time_quantiles()
+    print(f"{args.runs} runs ({params['update']} updates), peak infected at step "
+          + ", ".join(f"q{q}={t:.0f}" for q, t in peaks.items()))
+    print_counts("Mean final counts", dict(zip("SIRD", result.mean[-1].round(1).tolist())))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Agent based simulation of an infection spreading through a social network")
+    commands = parser.add_subparsers(dest="command")
+
+    def add_population_args(command):
+        command.add_argument("-n", "--population", type=int, help="number of agents to generate")
+        command.add_argument("-i", "--input", help="population snapshot to load instead of generating one")
+        command.add_argument("--seed", type=int, default=None, help="random seed")
+
+    def add_model_args(command):
+        command.add_argument("--steps", type=int, default=200, help="number of steps to simulate")
+        command.add_argument("--mortality-rate", type=float, default=0.05)
+        command.add_argument("--base-prob", type=float, default=0.15, help="base transmission probability")
+        command.add_argument("--update", choices=("sweep", "synchronous"), default=None,
+                             help="sweep (default): agents infected during a step spread in it when their turn "
+                                  "comes later, like the original per-agent loop; synchronous: they spread from "
+                                  "the next step, a slower epidemic (the only mode of the sharded engine)")
+
+    generate = commands.add_parser("generate", help="generate a population and save it as a snapshot")
+    add_population_args(generate)
+    generate.add_argument("-o", "--output", required=True, help="snapshot file to write")
+    generate.set_defaults(func=cmd_generate)
+
+    run = commands.add_parser("run", help="run one simulation headless")
+    add_population_args(run)
+    add_model_args(run)
+    run.add_argument("-o", "--output", help="directory to record per-step aggregates into")
+    run.add_argument("--checkpoint-dir", help="write checkpoints here, and resume from it if it has one")
+    run.add_argument("--checkpoint-every", type=int, default=50)
+    run.add_argument("--trace", help="write a Chrome trace of the phase timings to this file")
+    run.add_argument("--engine", choices=("frontier", "keyed", "serial", "sharded", "gillespie"), default="frontier",
+                     help="frontier: fastest on one core; keyed/serial/sharded: counter-based draws, "
+                          "identical runs for a seed; gillespie: continuous time, sampled daily")
+    run.add_argument("--workers", type=int, default=None, help="processes for the sharded engine (default: all cores)")
+    run.add_argument("--compact-dead-fraction", type=float, default=None,
+                     help="frontier engine: drop dead agents from the adjacency every time this share of the "
+                          "population died (e.g. 0.1)")
+    run.set_defaults(func=cmd_run)
+
+    gui = commands.add_parser("gui", help="run the interactive visualization")
+    add_population_args(gui)
+    gui.add_argument("-o", "--output", help="directory to record per-step aggregates into")
+    gui.add_argument("--profile", action="store_true", help="start with the profiling overlay shown")
+    gui.add_argument("--trace", help="write a Chrome trace of the phase timings to this file on exit")
+    gui.set_defaults(func=cmd_gui)
+
+    ens = commands.add_parser("ensemble", help="run many replicates and aggregate the curves")
+    add_population_args(ens)
+    add_model_args(ens)
+    ens.add_argument("--runs", type=int, default=20)
+    ens.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    ens.add_argument("-o", "--output", help=".npz file for the curves, mean and quantiles")
+    ens.add_argument("--record-dir", help="directory to record every replicate's per-step aggregates into")
+    ens.set_defaults(func=cmd_ensemble)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        # no command: the original interactive start
+        total_population = int(input("Please enter the total number of people: "))
+        args = build_parser().parse_args(["gui", "--population", str(total_population)])
+    args.func(args)
 
 
 if __name__ == "__main__":
-    # st()
-    run_visualization(create_graph())
-    
-    
+    main()
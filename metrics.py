@@ -0,0 +1,124 @@
+import numpy as np
+import agent
+from agent import DEAD, INFECTED, RECOVERED, STATUS_NAMES, SUSCEPTIBLE
+
+# Epidemic metrics kept up to date from the transitions every engine's step() returns,
+# so a step costs O(transitions) here no matter how big the population is. Only the
+# constructor looks at every agent (current statuses, age bands).
+
+RT_WINDOW = 7  # steps the reproduction number is averaged over
+
+
+def cluster_status_counts(cluster, status, num_clusters):
+    """(num_clusters, 4) int32 S/I/R/D counts of every cluster"""
+    codes = cluster.astype(np.int64) * len(STATUS_NAMES) + status
+    return np.bincount(codes, minlength=num_clusters * len(STATUS_NAMES)) \
+        .reshape(num_clusters, len(STATUS_NAMES)).astype(np.int32)
+
+
+def apply_transitions(cluster_counts, cluster, transitions):
+    """Move the agents of one step's (new_infections, recovered, dead) between the columns
+    of cluster_counts, in place.
+
+    np.add.at only touches the clusters of the agents that changed, bincount(minlength=
+    num_clusters) would cost O(clusters) per step however quiet the step was.
+    """
+    new_infections, recovered, dead = transitions
+    np.add.at(cluster_counts[:, SUSCEPTIBLE], cluster[new_infections], -1)
+    np.add.at(cluster_counts[:, INFECTED], cluster[new_infections], 1)
+    np.add.at(cluster_counts[:, INFECTED], cluster[recovered], -1)
+    np.add.at(cluster_counts[:, RECOVERED], cluster[recovered], 1)
+    np.add.at(cluster_counts[:, INFECTED], cluster[dead], -1)
+    np.add.at(cluster_counts[:, DEAD], cluster[dead], 1)
+
+
+def band_labels(bands=agent.AGE_BANDS):
+    """"0-17", "18-59", "60+" style labels of an age band table"""
+    starts = [band[0] for band in bands]
+    return [f"{start}-{end - 1}" for start, end in zip(starts, starts[1:])] + [f"{starts[-1]}+"]
+
+
+class EpidemicMetrics:
+    """Per-cluster S/I/R/D, daily incidence, effective reproduction number, attack rate and
+    cases and deaths per age band of one run.
+
+    Call update(engine, transitions) after every step. rows holds one
+    (step, S, I, R, D, incidence, rt) tuple per step, starting with the initial state, and is
+    only ever appended to, so another thread can read it while the engine runs.
+
+    The engines do not track who infected whom, so rt is estimated from the aggregates:
+    new infections per infected agent-day over the last RT_WINDOW steps, times the mean
+    infectious period. That is the number of infections one case causes while infectious
+    at the current transmission rate.
+    """
+
+    def __init__(self, engine, age_bands=agent.AGE_BANDS):
+        population = engine.population
+        self.size = len(population)
+        self.cluster = population.cluster
+        self.num_clusters = int(self.cluster.max()) + 1 if self.size else 0
+        self.age_bands = age_bands
+        self.band_labels = band_labels(age_bands)
+        self.band = (np.searchsorted([band[0] for band in age_bands], population.age, side="right") - 1).astype(np.int8)
+        self.infectious_period = float(population.recovery_time.mean()) if self.size else 0.0
+
+        status = engine.status
+        self.counts = np.bincount(status, minlength=len(STATUS_NAMES)).astype(np.int64)
+        self.cluster_counts = cluster_status_counts(self.cluster, status, self.num_clusters)
+        # everyone not susceptible anymore has been a case
+        self.band_cases = np.bincount(self.band[status != SUSCEPTIBLE], minlength=len(age_bands)).astype(np.int64)
+        self.band_deaths = np.bincount(self.band[status == DEAD], minlength=len(age_bands)).astype(np.int64)
+        self.cumulative_cases = int(self.band_cases.sum())
+
+        self.time_step = engine.time_step
+        self.incidence = 0
+        self.rt = float("nan")
+        self._window = []  # (new infections, infected at the start of the step) of the last RT_WINDOW steps
+        self.rows = [self._row()]
+
+    def _row(self):
+        return (self.time_step, *self.counts.tolist(), self.incidence, self.rt)
+
+    def update(self, engine, transitions):
+        """Account for one step, transitions is what engine.step() returned"""
+        new_infections, recovered, dead = transitions
+        infected_before = int(self.counts[INFECTED])
+        self.counts[SUSCEPTIBLE] -= len(new_infections)
+        self.counts[INFECTED] += len(new_infections) - len(recovered) - len(dead)
+        self.counts[RECOVERED] += len(recovered)
+        self.counts[DEAD] += len(dead)
+
+        apply_transitions(self.cluster_counts, self.cluster, transitions)
+        np.add.at(self.band_cases, self.band[new_infections], 1)
+        np.add.at(self.band_deaths, self.band[dead], 1)
+
+        self.incidence = len(new_infections)
+        self.cumulative_cases += self.incidence
+        self._window.append((self.incidence, infected_before))
+        if len(self._window) > RT_WINDOW:
+            del self._window[0]
+        infected_days = sum(infected for _, infected in self._window)
+        self.rt = sum(new for new, _ in self._window) / infected_days * self.infectious_period \
+            if infected_days else float("nan")
+        self.time_step = engine.time_step
+        self.rows.append(self._row())
+
+    @property
+    def attack_rate(self):
+        """Share of the population that has been infected so far"""
+        return self.cumulative_cases / self.size if self.size else 0.0
+
+    def status_counts(self):
+        return dict(zip(STATUS_NAMES, self.counts.tolist()))
+
+    def summary(self):
+        """The scalar metrics as a small dict, cheap enough to take every frame"""
+        return {
+            "time_step": self.time_step,
+            "counts": self.status_counts(),
+            "incidence": self.incidence,
+            "rt": self.rt,
+            "attack_rate": self.attack_rate,
+            "band_cases": dict(zip(self.band_labels, self.band_cases.tolist())),
+            "band_deaths": dict(zip(self.band_labels, self.band_deaths.tolist())),
+        }
@@ -0,0 +1,93 @@
+import multiprocessing
+import numpy as np
+from shared_arrays import attach_arrays, share_arrays
+
+# header slots
+COUNT, CLOSED = 0, 1
+
+
+class SampleRing:
+    """Fixed size ring of sample rows (int64 unless dtype says otherwise) in shared memory,
+    one writer and one reader.
+
+    The writer appends rows and bumps a total row count, the reader keeps its own cursor
+    into that count and copies only the rows it has not seen yet, so a sample crosses
+    the process boundary once no matter how long the run gets. The ready event wakes
+    the reader when there is something new (or the ring got closed).
+    """
+
+    def __init__(self, columns, capacity=4096, dtype=np.int64):
+        self.capacity = capacity
+        self.shm, self.spec = share_arrays({
+            "header": np.zeros(2, dtype=np.int64),
+            "samples": np.zeros((capacity, columns), dtype=dtype),
+        })
+        self.spec["capacity"] = capacity
+        arrays = {name: np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=start)
+                  for name, dtype, shape, start in self.spec["layout"]}
+        self.header, self.samples = arrays["header"], arrays["samples"]
+        self.ready = multiprocessing.Event()
+
+    @property
+    def count(self):
+        return int(self.header[COUNT])
+
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=self.samples.dtype).reshape(-1, self.samples.shape[1])[-self.capacity:]
+        start = self.count
+        slots = (start + np.arange(len(rows))) % self.capacity
+        self.samples[slots] = rows
+        # rows first, count last: a reader never sees the count of a row that is not written yet
+        self.header[COUNT] = start + len(rows)
+        self.ready.set()
+
+    def close(self):
+        """Tell the reader no more rows are coming"""
+        self.header[CLOSED] = 1
+        self.ready.set()
+
+    def release(self):
+        self.samples = self.header = None  # views into the block have to go before it is closed
+        self.shm.close()
+        self.shm.unlink()
+
+
+class RingReader:
+    """Reading end of a SampleRing, built in the other process from (spec, ready)"""
+
+    def __init__(self, spec, ready, cursor=0):
+        self.shm, arrays = attach_arrays(spec)
+        self.header, self.samples = arrays["header"], arrays["samples"]
+        self.capacity = spec["capacity"]
+        self.ready = ready
+        self.cursor = cursor
+        self.lost = 0  # rows overwritten before they were read
+
+    @property
+    def closed(self):
+        return bool(self.header[CLOSED])
+
+    def wait(self, timeout=None):
+        """Block until the writer appended or closed (or timeout), True if it did"""
+        if self.ready.wait(timeout):
+            self.ready.clear()
+            return True
+        return False
+
+    def read(self):
+        """All rows appended since the last read, oldest first"""
+        end = int(self.header[COUNT])
+        start = max(self.cursor, end - self.capacity)
+        rows = self.samples[np.arange(start, end) % self.capacity].copy()
+        # the writer may have lapped us while copying, those rows can be torn
+        overwritten = min(int(self.header[COUNT]) - self.capacity - start, len(rows))
+        if overwritten > 0:
+            rows = rows[overwritten:]
+            start += overwritten
+        self.lost += start - self.cursor
+        self.cursor = end
+        return rows
+
+    def detach(self):
+        self.samples = self.header = None
+        self.shm.close()
@@ -0,0 +1,220 @@
+import numpy as np
+import agent
+from agent import SUSCEPTIBLE
+
+
+class AgentView:
+    """Lightweight stand-in for agent.Agent that reads one row of an AgentPopulation.
+
+    Views hold nothing but the population and the row number, so they can be created
+    on the fly (e.g. for the hover panel) without copying any agent data. Status and
+    immunity are read-only: the engine keeps counts, infection times and transmission
+    factors derived from them, change them with engine.infect() and engine.set_immunity().
+    """
+    __slots__ = ("population", "id")
+
+    def __init__(self, population, id):
+        self.population = population
+        self.id = id
+
+    @property
+    def age(self):
+        return int(self.population.age[self.id])
+
+    @property
+    def immunity(self):
+        return float(self.population.immunity[self.id])
+
+    @property
+    def mobility(self):
+        return float(self.population.mobility[self.id])
+
+    @property
+    def cluster(self):
+        return int(self.population.cluster[self.id])
+
+    @property
+    def status(self):
+        return agent.STATUS_NAMES[self.population.status[self.id]]
+
+    @property
+    def last_infected_timestep(self):
+        return int(self.population.last_infected_timestep[self.id])
+
+    @property
+    def recovery_time(self):
+        return int(self.population.recovery_time[self.id])
+
+    @property
+    def neighbours(self):
+        return self.population.neighbours(self.id)
+
+    @property
+    def pos(self):
+        return tuple(self.population.pos[self.id])
+
+    @pos.setter
+    def pos(self, value):
+        self.population.pos[self.id] = value
+
+    def __repr__(self):
+        return f"AgentView(id={self.id}, status={self.status!r}, cluster={self.cluster})"
+
+
+# Columns that never change while a simulation runs, the rest (status, timestamps) is per run state
+STATIC_COLUMNS = ("age", "immunity", "mobility", "cluster", "recovery_time", "indptr", "indices")
+
+
+class AgentPopulation:
+    """Structure-of-arrays replacement for the dict of Agent objects returned by create_graph.
+
+    Every attribute of agent.Agent is a typed column indexed by agent id and the
+    neighbour sets are stored once as CSR arrays (indptr, indices). The object also
+    behaves like the old read-only dict (len, [], keys/values/items), handing out
+    AgentView objects so code written against agent.Agent keeps working.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.id = np.arange(size, dtype=np.int32)
+        self.age = np.zeros(size, dtype=np.uint8)
+        self.immunity = np.zeros(size, dtype=np.float32)
+        self.mobility = np.zeros(size, dtype=np.float32)
+        self.cluster = np.zeros(size, dtype=np.int32)
+        self.status = np.full(size, SUSCEPTIBLE, dtype=np.int8)
+        self.last_infected_timestep = np.full(size, -1, dtype=np.int32)
+        self.recovery_time = np.zeros(size, dtype=np.int16)
+        self.indptr = np.zeros(size + 1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int32)
+        self.pos = np.zeros((size, 2), dtype=np.float64)
+        # filled in by create_graph (see connectivity.component_stats)
+        self.generator_params = {}
+        self.connectivity_stats = {}
+        # set when the population was loaded from a snapshot file (see snapshot.load_population)
+        self.snapshot_path = None
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Population on top of existing arrays (shared memory, memmaps...) without copying them.
+
+        columns must hold at least STATIC_COLUMNS, missing per run columns start fresh.
+        """
+        population = cls.__new__(cls)
+        population.size = len(columns["indptr"]) - 1
+        population.id = np.arange(population.size, dtype=np.int32)
+        for name in STATIC_COLUMNS:
+            setattr(population, name, columns[name])
+        population.status = columns.get("status", np.full(population.size, SUSCEPTIBLE, dtype=np.int8))
+        population.last_infected_timestep = columns.get(
+            "last_infected_timestep", np.full(population.size, -1, dtype=np.int32))
+        population.pos = columns.get("pos", np.zeros((population.size, 2), dtype=np.float64))
+        population.generator_params = {}
+        population.connectivity_stats = {}
+        population.snapshot_path = None
+        return population
+
+    def static_columns(self):
+        return {name: getattr(self, name) for name in STATIC_COLUMNS}
+
+    def fresh_copy(self):
+        """Population sharing this one's static columns but with everyone susceptible again"""
+        return AgentPopulation.from_columns(dict(self.static_columns(), pos=self.pos))
+
+    # ---- adjacency ----
+
+    def set_neighbour_sets(self, neighbour_sets):
+        """Fill the CSR adjacency from one iterable of neighbour ids per agent"""
+        degree = np.fromiter((len(s) for s in neighbour_sets), dtype=np.int64, count=self.size)
+        self.indptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(degree, out=self.indptr[1:])
+        self.indices = np.empty(self.indptr[-1], dtype=np.int32)
+        for i, s in enumerate(neighbour_sets):
+            self.indices[self.indptr[i]:self.indptr[i + 1]] = sorted(s)
+
+    def set_edges(self, u, v):
+        """Fill the CSR adjacency from an undirected edge list, duplicates and self loops are dropped"""
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        keep = u != v
+        lo, hi = np.minimum(u[keep], v[keep]), np.maximum(u[keep], v[keep])
+        key = lo * self.size + hi
+        key.sort()
+        first = np.ones(len(key), dtype=bool)
+        first[1:] = key[1:] != key[:-1]
+        key = key[first]
+        lo, hi = np.divmod(key, self.size)
+        # both directions, sorted by (source, target) so every row comes out sorted
+        both = np.concatenate((key, hi * self.size + lo))
+        both.sort()
+        src, dst = np.divmod(both, self.size)
+        self.indptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=self.size), out=self.indptr[1:])
+        self.indices = dst.astype(np.int32)
+
+    def neighbours(self, agent_id):
+        return self.indices[self.indptr[agent_id]:self.indptr[agent_id + 1]]
+
+    @property
+    def degree(self):
+        return np.diff(self.indptr)
+
+    @property
+    def num_edges(self):
+        return len(self.indices) // 2
+
+    def edges(self):
+        """Undirected edge list as two arrays (u, v) with u < v"""
+        u = np.repeat(self.id, self.degree)
+        keep = u < self.indices
+        return u[keep], self.indices[keep]
+
+    # ---- dict compatibility ----
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, agent_id):
+        if not 0 <= agent_id < self.size:
+            raise KeyError(agent_id)
+        return AgentView(self, int(agent_id))
+
+    def __contains__(self, agent_id):
+        return 0 <= agent_id < self.size
+
+    def __iter__(self):
+        return iter(range(self.size))
+
+    def keys(self):
+        return range(self.size)
+
+    def values(self):
+        return (AgentView(self, i) for i in range(self.size))
+
+    def items(self):
+        return ((i, AgentView(self, i)) for i in range(self.size))
+
+    # ---- memory accounting ----
+
+    def nbytes(self):
+        columns = (self.id, self.age, self.immunity, self.mobility, self.cluster, self.status,
+                   self.last_infected_timestep, self.recovery_time, self.indptr, self.indices, self.pos)
+        return sum(c.nbytes for c in columns)
+
+    def bytes_per_agent(self):
+        return self.nbytes() / max(1, self.size)
+
+    @classmethod
+    def from_agents(cls, agents):
+        """Convert a dict of agent.Agent objects (ids 0..n-1) into a population"""
+        population = cls(len(agents))
+        for i in range(population.size):
+            a = agents[i]
+            population.age[i] = a.age
+            population.immunity[i] = a.immunity
+            population.mobility[i] = a.mobility
+            population.cluster[i] = a.cluster if a.cluster is not None else -1
+            population.status[i] = agent.STATUS_NAMES.index(a.status)
+            population.last_infected_timestep[i] = a.last_infected_timestep
+            population.recovery_time[i] = a.recovery_time
+        population.set_neighbour_sets([agents[i].neighbours for i in range(population.size)])
+        return population
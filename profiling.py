@@ -0,0 +1,137 @@
+import collections
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Phase timings for the simulation, the renderer and the graph generator.
+#
+#     lap = profiling.laps("step")      # at the start of a function
+#     ...                               # infection part
+#     lap("infection")                  # records the time since the previous lap (or laps())
+#
+#     with profiling.phase("frame.hover"):
+#         ...
+#
+# While profiling is disabled laps() hands out a function that does nothing and phase() a
+# shared do-nothing context manager, so the instrumentation points cost one call each.
+
+HISTOGRAM_BINS = np.logspace(-6, 0, 25)  # 1 us .. 1 s, 4 bins per decade
+
+
+class Profiler:
+    """Rolling per-phase timings plus a bounded buffer of trace events.
+
+    Every phase keeps its last `window` durations, summary() turns them into
+    statistics and a histogram. The trace buffer keeps the last max_events
+    (name, start, duration, thread) records for export_chrome_trace().
+    """
+
+    def __init__(self, window=300, max_events=200_000):
+        self.window = window
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.durations = {}
+        self.events = collections.deque(maxlen=max_events)
+
+    def record(self, name, start, end):
+        samples = self.durations.get(name)
+        if samples is None:
+            samples = self.durations.setdefault(name, collections.deque(maxlen=self.window))
+        samples.append(end - start)
+        self.events.append((name, start, end - start, threading.get_ident()))
+
+    def reset(self):
+        self.durations = {}
+        self.events.clear()
+
+    def summary(self):
+        """{phase: {count, mean, p95, max, histogram}} over the rolling window, times in seconds"""
+        result = {}
+        for name, samples in sorted(self.durations.items()):
+            values = np.array(list(samples))  # list() first, the worker thread may be appending
+            if len(values) == 0:
+                continue
+            result[name] = {
+                "count": len(values),
+                "mean": float(values.mean()),
+                "p95": float(np.quantile(values, 0.95)),
+                "max": float(values.max()),
+                "histogram": np.histogram(values, bins=HISTOGRAM_BINS)[0],
+            }
+        return result
+
+    def export_chrome_trace(self, path):
+        """Write the buffered events as Chrome trace-event JSON (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        events = list(self.events)
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": names.get(tid, str(tid))}}
+                 for tid in sorted({event[3] for event in events})]
+        trace.extend({"name": name, "cat": name.split(".")[0], "ph": "X", "pid": pid, "tid": tid,
+                      "ts": (start - self.origin) * 1e6, "dur": duration * 1e6}
+                     for name, start, duration, tid in events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+
+class _Laps:
+    __slots__ = ("profiler", "prefix", "last")
+
+    def __init__(self, profiler, prefix):
+        self.profiler = profiler
+        self.prefix = prefix
+        self.last = time.perf_counter()
+
+    def __call__(self, name):
+        now = time.perf_counter()
+        self.profiler.record(f"{self.prefix}.{name}", self.last, now)
+        self.last = now
+
+
+class _Phase:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+
+
+class _NullPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+def _no_lap(name):
+    pass
+
+
+_NULL_PHASE = _NullPhase()
+PROFILER = Profiler()
+
+
+def enable():
+    PROFILER.enabled = True
+
+
+def disable():
+    PROFILER.enabled = False
+
+
+def laps(prefix):
+    return _Laps(PROFILER, prefix) if PROFILER.enabled else _no_lap
+
+
+def phase(name):
+    return _Phase(PROFILER, name) if PROFILER.enabled else _NULL_PHASE
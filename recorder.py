@@ -0,0 +1,190 @@
+import json
+import os
+import numpy as np
+from agent import STATUS_NAMES
+from metrics import apply_transitions, cluster_status_counts
+
+# A recording directory holds
+#   index.json          format version, number of clusters and the step range of every chunk
+#   chunk-<seq>.npz     one array per column for a run of consecutive steps
+# Chunks are written as soon as they are full (and the index rewritten after them), so a
+# long run only ever holds one chunk in memory and a crash loses at most that chunk.
+RECORDING_VERSION = 1
+
+# per step columns: name -> (dtype, shape of one row given the number of clusters)
+COLUMNS = {
+    "step": (np.int64, lambda clusters: ()),
+    "counts": (np.int64, lambda clusters: (len(STATUS_NAMES),)),
+    "new_infections": (np.int64, lambda clusters: ()),
+    "recovered": (np.int64, lambda clusters: ()),
+    "dead": (np.int64, lambda clusters: ()),
+    "cluster_counts": (np.int32, lambda clusters: (clusters, len(STATUS_NAMES))),
+    "cluster_new_infections": (np.int32, lambda clusters: (clusters,)),
+}
+
+
+class RecordingError(Exception):
+    pass
+
+
+class Recorder:
+    """Streams per-step aggregates of a running engine into directory.
+
+    Every step records the S/I/R/D counts, how many agents got infected, recovered and
+    died, and the S/I/R/D counts and new infections of every cluster. The per-cluster
+    counts are kept up to date from the transitions step() returns, not recounted. With
+    metrics (a metrics.EpidemicMetrics of the same engine) they are its cluster_counts,
+    so metrics.update() has to run before record() every step.
+    Rows are buffered into chunks of about chunk_bytes.
+
+    With resume an existing recording is continued instead of refused: it is cut back to
+    engine.time_step (a run restored from a checkpoint) and the next step is appended.
+    """
+
+    def __init__(self, directory, engine, chunk_bytes=32 * 1024 * 1024, metrics=None, resume=False):
+        self.directory = directory
+        self.cluster = engine.population.cluster
+        self.num_clusters = int(self.cluster.max()) + 1 if len(self.cluster) else 0
+        shapes = {name: shape(self.num_clusters) for name, (_, shape) in COLUMNS.items()}
+        row_bytes = sum(np.dtype(dtype).itemsize * int(np.prod(shapes[name])) for name, (dtype, _) in COLUMNS.items())
+        self.chunk_steps = max(1, chunk_bytes // row_bytes)
+        self._buffers = {name: np.zeros((self.chunk_steps,) + shapes[name], dtype=dtype)
+                         for name, (dtype, _) in COLUMNS.items()}
+        self._rows = 0
+        self._chunks = []
+
+        os.makedirs(directory, exist_ok=True)
+        self.metrics = metrics
+        self.cluster_counts = metrics.cluster_counts if metrics is not None \
+            else cluster_status_counts(self.cluster, engine.status, self.num_clusters)
+        if os.path.exists(os.path.join(directory, "index.json")):
+            if not resume:
+                raise RecordingError(f"{directory} already holds a recording")
+            self._truncate(engine.time_step)
+        else:
+            empty = np.empty(0, dtype=np.int64)
+            self._append(engine, empty, empty, empty)
+
+    def _truncate(self, step):
+        """Drop everything recorded after step, the recording has to reach it"""
+        recording = Recording(self.directory)
+        if recording.num_clusters != self.num_clusters:
+            raise RecordingError(f"{self.directory} has {recording.num_clusters} clusters, "
+                                 f"the population {self.num_clusters}")
+        if recording.last_step is None or recording.last_step < step:
+            raise RecordingError(f"{self.directory} ends at step {recording.last_step}, before step {step} to resume from")
+        for chunk in recording.chunks:
+            path = os.path.join(self.directory, chunk["file"])
+            if chunk["first_step"] > step:
+                os.remove(path)
+                continue
+            if chunk["last_step"] > step:
+                with np.load(path) as data:
+                    keep = data["step"] <= step
+                    columns = {column: data[column][keep] for column in data.files}
+                with open(path + ".tmp", "wb") as f:
+                    np.savez(f, **columns)
+                os.replace(path + ".tmp", path)
+                chunk = dict(chunk, last_step=step, rows=int(np.count_nonzero(keep)))
+            self._chunks.append(chunk)
+        self._write_index()
+
+    def record(self, engine, transitions):
+        """Record the step engine just took, transitions is what engine.step() returned"""
+        if self.metrics is None:
+            apply_transitions(self.cluster_counts, self.cluster, transitions)
+        self._append(engine, *transitions)
+
+    def _append(self, engine, new_infections, recovered, dead):
+        row = self._rows
+        buffers = self._buffers
+        buffers["step"][row] = engine.time_step
+        buffers["counts"][row] = list(engine.status_counts.values())
+        buffers["new_infections"][row] = len(new_infections)
+        buffers["recovered"][row] = len(recovered)
+        buffers["dead"][row] = len(dead)
+        buffers["cluster_counts"][row] = self.cluster_counts
+        buffers["cluster_new_infections"][row] = 0
+        np.add.at(buffers["cluster_new_infections"][row], self.cluster[new_infections], 1)
+        self._rows += 1
+        if self._rows == self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as a new chunk"""
+        if self._rows == 0:
+            return
+        name = f"chunk-{len(self._chunks):06d}.npz"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **{column: buffer[:self._rows] for column, buffer in self._buffers.items()})
+        os.replace(path + ".tmp", path)
+        steps = self._buffers["step"]
+        self._chunks.append({"file": name, "first_step": int(steps[0]), "last_step": int(steps[self._rows - 1]),
+                             "rows": self._rows})
+        self._rows = 0
+        self._write_index()
+
+    def _write_index(self):
+        index = {"version": RECORDING_VERSION, "num_clusters": self.num_clusters,
+                 "columns": list(COLUMNS), "chunks": self._chunks}
+        path = os.path.join(self.directory, "index.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        self.flush()
+
+
+class Recording:
+    """Lazy reader for a directory written by Recorder, only the chunks a query touches are loaded"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            with open(os.path.join(directory, "index.json")) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            raise RecordingError(f"No recording in {directory}")
+        if index["version"] != RECORDING_VERSION:
+            raise RecordingError(f"Unsupported recording version {index['version']}")
+        self.num_clusters = index["num_clusters"]
+        self.columns = index["columns"]
+        self.chunks = index["chunks"]
+
+    def __len__(self):
+        return sum(chunk["rows"] for chunk in self.chunks)
+
+    @property
+    def first_step(self):
+        return self.chunks[0]["first_step"] if self.chunks else None
+
+    @property
+    def last_step(self):
+        return self.chunks[-1]["last_step"] if self.chunks else None
+
+    def read(self, column, start=None, stop=None):
+        """Rows of column for the steps in [start, stop), e.g. read("counts", 1000, 2000)"""
+        if column not in self.columns:
+            raise RecordingError(f"Unknown column {column!r}, expected one of {self.columns}")
+        if not self.chunks:
+            start = stop = 0
+        start = self.first_step if start is None else start
+        stop = self.last_step + 1 if stop is None else stop
+        parts = []
+        for chunk in self.chunks:
+            if chunk["last_step"] < start or chunk["first_step"] >= stop:
+                continue
+            with np.load(os.path.join(self.directory, chunk["file"])) as data:
+                steps = data["step"]
+                keep = (steps >= start) & (steps < stop)
+                parts.append(data[column][keep])
+        if not parts:
+            dtype, shape = COLUMNS[column]
+            return np.zeros((0,) + shape(self.num_clusters), dtype=dtype)
+        return np.concatenate(parts)
+
+    def cluster_curve(self, cluster, start=None, stop=None):
+        """(steps, 4) S/I/R/D counts of one cluster"""
+        return self.read("cluster_counts", start, stop)[:, cluster]
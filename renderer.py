@@ -0,0 +1,199 @@
+import numpy as np
+import pygame
+import profiling
+from agent import DEAD
+
+BACKGROUND = (30, 30, 30)
+EDGE_COLOR = (150, 150, 150)
+EDGE_ALPHA = 0.6  # opacity of a single edge, overlapping edges get brighter
+# Node colors indexed by status code (S, I, R, D)
+STATUS_COLORS = np.array([(0, 200, 0), (200, 0, 0), (0, 0, 200), (40, 40, 40)], dtype=np.uint8)
+
+
+def clip_segments(p0, p1, width, height):
+    """Clip segments p0-p1 to the rectangle [0, width) x [0, height) (Liang-Barsky, vectorized).
+
+    Returns the clipped endpoints and a mask of the segments that are at least partly visible.
+    """
+    d = p1 - p0
+    t0 = np.zeros(len(p0))
+    t1 = np.ones(len(p0))
+    visible = np.ones(len(p0), dtype=bool)
+    for p, q in ((-d[:, 0], p0[:, 0]), (d[:, 0], width - 1 - p0[:, 0]),
+                 (-d[:, 1], p0[:, 1]), (d[:, 1], height - 1 - p0[:, 1])):
+        parallel = p == 0
+        visible &= ~(parallel & (q < 0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = q / p
+        entering = ~parallel & (p < 0)
+        leaving = ~parallel & (p > 0)
+        t0 = np.where(entering, np.maximum(t0, r), t0)
+        t1 = np.where(leaving, np.minimum(t1, r), t1)
+    visible &= t0 <= t1
+    return p0 + d * t0[:, None], p0 + d * t1[:, None], visible
+
+
+def edge_pixels(width, height, p0, p1):
+    """Flat index (x * height + y) of every pixel the segments p0-p1 cover, once per segment.
+
+    Every segment is sampled once per pixel along its major axis, so the cost is the
+    number of visible edge pixels, all in a handful of array operations.
+    """
+    p0, p1, visible = clip_segments(p0, p1, width, height)
+    p0, p1 = p0[visible], p1[visible]
+    d = p1 - p0
+    steps = np.ceil(np.abs(d).max(axis=1)).astype(np.int64) + 1
+    total = int(steps.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    segment = np.repeat(np.arange(len(steps)), steps)
+    start = np.cumsum(steps) - steps
+    t = (np.arange(total) - start[segment]) / np.maximum(steps - 1, 1)[segment]
+    x = np.clip(np.rint(p0[segment, 0] + d[segment, 0] * t).astype(np.int64), 0, width - 1)
+    y = np.clip(np.rint(p0[segment, 1] + d[segment, 1] * t).astype(np.int64), 0, height - 1)
+    return x * height + y
+
+
+def rasterize_edges(width, height, p0, p1):
+    """Number of edges covering every pixel, as a (width, height) array"""
+    return np.bincount(edge_pixels(width, height, p0, p1), minlength=width * height).reshape(width, height)
+
+
+def shade(coverage):
+    """Colors (uint8 RGB) of pixels covered by `coverage` edges drawn on top of each other"""
+    alpha = 1 - (1 - EDGE_ALPHA) ** np.minimum(coverage, 16)
+    background = np.array(BACKGROUND, dtype=np.float64)
+    return (background + alpha[..., None] * (np.array(EDGE_COLOR) - background)).astype(np.uint8)
+
+
+def disc_offsets(radius):
+    """Pixel offsets (dx, dy) covered by a filled circle of the given radius"""
+    r = int(radius)
+    dx, dy = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dx * dx + dy * dy <= r * r
+    return dx[inside], dy[inside]
+
+
+class GraphRenderer:
+    """Draws the population graph with a cached edge layer and batched node writes.
+
+    The edges are rasterized once into an off-screen surface that is only rebuilt when
+    the view changes (invalidate(), window size). Given the camera's view, a pan is told
+    from a zoom and the layer just blitted at the pixel offset while the drag goes on; it
+    is redrawn once the drag ends or the uncovered border grows past max_pan_border of
+    the window, a zoom redraws it at once. The per-pixel edge count is kept with it, so
+    when agents die only their edges are rasterized again, subtracted and the pixels
+    they touched reshaded; a death costs its own edge pixels, never a rebuild.
+    Nodes are written straight into the screen's pixel array, one fancy-indexed
+    assignment per status color.
+    """
+
+    def __init__(self, edge_u, edge_v, compact_dead_fraction=0.1, max_pan_border=0.25):
+        self.edge_u = edge_u
+        self.edge_v = edge_v
+        self.compact_dead_fraction = compact_dead_fraction
+        self.max_pan_border = max_pan_border
+        self._edge_surface = None
+        self._coverage = None  # edges per pixel of the layer
+        self._layer_size = None
+        self._layer_pos = None  # screen positions the layer was rasterized at
+        self._layer_dead = None  # dead agents whose edges are not in the layer
+        self._layer_view = None  # (scale, offset) of the camera the layer was drawn for
+        self._num_dead = 0
+        self._view_dirty = True
+
+    def invalidate(self):
+        """The view changed (zoom, pan, new layout), edges are redrawn on the next frame"""
+        self._view_dirty = True
+
+    def _pan_shift(self, view, size):
+        """Pixel offset of view from the view the layer was drawn for, None unless that is
+        a translation small enough to show the layer shifted"""
+        if view is None:
+            return 0, 0
+        if self._layer_view is None or view[0] != self._layer_view[0]:
+            return None
+        dx, dy = np.rint(np.asarray(view[1]) - self._layer_view[1]).astype(int).tolist()
+        if abs(dx) > self.max_pan_border * size[0] or abs(dy) > self.max_pan_border * size[1]:
+            return None
+        return dx, dy
+
+    def _build_edge_layer(self, size, screen_pos, status):
+        width, height = size
+        dead = status == DEAD
+        live = ~dead[self.edge_u] & ~dead[self.edge_v]
+        u, v = self.edge_u[live], self.edge_v[live]
+        # death is final, once enough edges are dead they are dropped instead of filtered on every rebuild
+        if len(u) < (1 - self.compact_dead_fraction) * len(live):
+            self.edge_u, self.edge_v = u, v
+        self._coverage = rasterize_edges(width, height, screen_pos[u], screen_pos[v])
+        self._edge_surface = pygame.surfarray.make_surface(shade(self._coverage))
+        self._layer_size = size
+        self._layer_pos = screen_pos.copy()
+        self._layer_dead = dead
+        self._num_dead = int(np.count_nonzero(dead))
+        self._view_dirty = False
+
+    def _remove_dead_edges(self, status):
+        """Take the edges of the agents that died since the layer was drawn out of it"""
+        dead = status == DEAD
+        died = dead & ~self._layer_dead
+        drawn = ~self._layer_dead[self.edge_u] & ~self._layer_dead[self.edge_v]
+        gone = drawn & (died[self.edge_u] | died[self.edge_v])
+        self._layer_dead = dead
+        self._num_dead = int(np.count_nonzero(dead))
+        if not gone.any():
+            return
+        width, height = self._layer_size
+        pixels, counts = np.unique(edge_pixels(width, height, self._layer_pos[self.edge_u[gone]],
+                                               self._layer_pos[self.edge_v[gone]]), return_counts=True)
+        coverage = self._coverage.reshape(-1)
+        coverage[pixels] -= counts
+        x, y = np.divmod(pixels, height)
+        surface_pixels = pygame.surfarray.pixels3d(self._edge_surface)
+        try:
+            surface_pixels[x, y] = shade(coverage[pixels])
+        finally:
+            del surface_pixels  # unlocks the surface
+
+    def draw(self, screen, screen_pos, status, radius, view=None, moving=False):
+        """Draw edges and living nodes; screen_pos is an (n, 2) array of pixel positions.
+
+        view is the (scale, offset) of the camera screen_pos comes from, moving tells
+        whether the view is still being dragged. Without a view every view change has
+        to be announced with invalidate().
+        """
+        lap = profiling.laps("draw")
+        size = screen.get_size()
+        shift = self._pan_shift(view, size)
+        if (self._edge_surface is None or self._view_dirty or self._layer_size != size or shift is None
+                or (shift != (0, 0) and not moving)):
+            self._build_edge_layer(size, screen_pos, status)
+            self._layer_view = None if view is None else (view[0], np.array(view[1], dtype=np.float64))
+            shift = (0, 0)
+            lap("edge_rebuild")
+        elif int(np.count_nonzero(status == DEAD)) != self._num_dead:
+            self._remove_dead_edges(status)
+            lap("edge_deaths")
+        if shift != (0, 0):
+            screen.fill(BACKGROUND)  # the border the shifted layer leaves uncovered
+        screen.blit(self._edge_surface, shift)
+        lap("edges")
+        self.draw_nodes(screen, screen_pos, status, radius)
+        lap("nodes")
+
+    def draw_nodes(self, screen, screen_pos, status, radius):
+        width, height = screen.get_size()
+        dx, dy = disc_offsets(radius)
+        pixels = pygame.surfarray.pixels3d(screen)
+        try:
+            for code, color in enumerate(STATUS_COLORS):
+                if code == DEAD:
+                    continue
+                ids = np.flatnonzero(status == code)
+                x = (screen_pos[ids, 0, None] + dx).ravel()
+                y = (screen_pos[ids, 1, None] + dy).ravel()
+                inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+                pixels[x[inside], y[inside]] = color
+        finally:
+            del pixels  # unlocks the screen surface
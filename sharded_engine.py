@@ -0,0 +1,302 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+import numpy as np
+import profiling
+from agent import SUSCEPTIBLE, INFECTED, RECOVERED, DEAD
+from population import AgentPopulation
+from shared_arrays import attach_arrays, share_arrays
+from step_engine import SYNCHRONOUS, KeyedStepEngine
+
+# One run spread over several processes. create_graph numbers agents cluster by cluster, so
+# a contiguous id range is a group of whole clusters; every worker owns one such range
+# (a shard) and is the only one that writes the status of its agents. A tick is
+#
+#   1. every worker samples the contacts of its infected agents and rolls the transmissions
+#      (keyed draws, see counter_rng). Targets inside the shard are kept, targets outside it
+#      (its ghost nodes) go into the worker's outbox in shared memory, grouped by owner.
+#   2. exchange barrier
+#   3. every worker reads the outbox sections addressed to it, infects the union with its
+#      local targets and handles recoveries and deaths of its own agents.
+#
+# Nobody writes a status before the exchange barrier, so everyone reads the state at the
+# start of the tick, exactly like KeyedStepEngine with update=SYNCHRONOUS, which a sharded
+# run reproduces bit for bit. A sweep would chain infections across shards in id order
+# within a tick, so it is not supported.
+#
+# The main process starts a tick by sending the command down every worker's pipe and waits
+# for all the replies together with the workers' process sentinels, so a worker that is
+# killed outright (OOM, SIGKILL, a crash in native code) ends the wait instead of hanging it.
+
+CMD_STEP, CMD_STOP = 1, 2
+# per worker stats of the last tick: transitions, boundary infections sent
+NEW, RECOVERED_COUNT, DEAD_COUNT, SENT = 0, 1, 2, 3
+COMPUTE, COMM = 0, 1
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+def shard_bounds(population, workers):
+    """Split the agents into (at most) workers contiguous ranges of whole clusters with about
+    equal work (agents + adjacency entries). Returns the workers + 1 range boundaries."""
+    n = len(population)
+    cuts = np.flatnonzero(np.diff(population.cluster)) + 1  # first agent of every cluster but the first
+    cost = population.indptr[cuts] + cuts
+    total = population.indptr[n] + n
+    wanted = total * np.arange(1, workers) / workers
+    inner = cuts[np.minimum(np.searchsorted(cost, wanted), len(cuts) - 1)] if len(cuts) else []
+    return np.unique(np.concatenate(([0], inner, [n]))).astype(np.int64)
+
+
+def ghost_counts(population, bounds):
+    """Number of distinct agents outside each shard that its agents are linked to"""
+    counts = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        neighbours = population.indices[population.indptr[lo]:population.indptr[hi]]
+        counts.append(len(np.unique(neighbours[(neighbours < lo) | (neighbours >= hi)])))
+    return np.array(counts, dtype=np.int64)
+
+
+class ShardedStepEngine(KeyedStepEngine):
+    """KeyedStepEngine that steps each shard of the population in its own process.
+
+    The static columns, the status columns, the transmission factors and the exchange
+    buffers live in shared memory; the engine's status and last_infected_timestep are
+    views of it, so snapshots, recorders and infect() work as with any other engine
+    (between steps, while the workers wait). close() stops the workers and copies the
+    state back into the population's own columns.
+
+    compute_time and comm_time hold the seconds every worker spent per tick working on
+    its shard and exchanging boundary infections (outboxes plus the barrier wait, which
+    is where load imbalance shows up); timing_summary() aggregates them.
+    """
+
+    def __init__(self, population, seed=0, workers=None, update=SYNCHRONOUS, **kwargs):
+        if update != SYNCHRONOUS:
+            raise ValueError(f"the sharded engine only supports update={SYNCHRONOUS!r}")
+        super().__init__(population, seed=seed, update=update, **kwargs)
+        self.bounds = shard_bounds(population, workers or os.cpu_count() or 1)
+        self.workers = len(self.bounds) - 1
+        self.ghosts = ghost_counts(population, self.bounds)
+        ghost_start = np.concatenate(([0], np.cumsum(self.ghosts)))
+        self.compute_time, self.comm_time = [], []
+        self.boundary_events = 0
+
+        columns = dict(population.static_columns(), status=self.status,
+                       last_infected_timestep=self.last_infected_timestep,
+                       transmit_factor=self.transmit_factor, receive_factor=self.receive_factor)
+        self._shm, spec = share_arrays(dict(
+            columns,
+            bounds=self.bounds,
+            ghost_start=ghost_start,
+            outbox=np.zeros(max(int(ghost_start[-1]), 1), dtype=np.int64),
+            outbox_offsets=np.zeros((self.workers, self.workers + 1), dtype=np.int64),
+            events=np.zeros(self.n, dtype=np.int64),  # transitions of the tick, in each worker's own range
+            stats=np.zeros((self.workers, 4), dtype=np.int64),
+            times=np.zeros((self.workers, 2), dtype=np.float64),
+        ))
+        # views straight on our own block, attaching to it a second time in this process is not needed
+        self._shared = {name: np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=start)
+                        for name, dtype, shape, start in spec["layout"]}
+        self.status = self._shared["status"]
+        self.last_infected_timestep = self._shared["last_infected_timestep"]
+        self.transmit_factor = self._shared["transmit_factor"]
+        self.receive_factor = self._shared["receive_factor"]
+
+        # one pipe per worker: (command, time step) goes down, None or an error message comes back
+        self._exchange = multiprocessing.Barrier(self.workers)
+        self._pipes, self._processes = [], []
+        for index in range(self.workers):
+            pipe, worker_pipe = multiprocessing.Pipe()
+            self._pipes.append(pipe)
+            self._processes.append(multiprocessing.Process(
+                target=_run_shard, daemon=True, name=f"shard-{index}",
+                args=(spec, index, seed, self.mortality_rate, self.base_prob, self._exchange, worker_pipe)))
+        for process in self._processes:
+            process.start()
+        self._closed = False
+
+    def step(self):
+        t = self.time_step
+        lap = profiling.laps("step")
+        try:
+            for pipe in self._pipes:
+                pipe.send((CMD_STEP, t))
+        except OSError:
+            raise ShardError(self._worker_error()) from None
+        self._wait_for_workers()
+        lap("shards")
+
+        stats, events = self._shared["stats"], self._shared["events"]
+        new_infections, recovered, dead = [], [], []
+        for index, lo in enumerate(self.bounds[:-1]):
+            new, rec, died = stats[index, [NEW, RECOVERED_COUNT, DEAD_COUNT]]
+            new_infections.append(events[lo:lo + new])
+            recovered.append(events[lo + new:lo + new + rec])
+            dead.append(events[lo + new + rec:lo + new + rec + died])
+        new_infections, recovered, dead = (np.concatenate(ids) for ids in (new_infections, recovered, dead))
+        self.boundary_events += int(stats[:, SENT].sum())
+        self.compute_time.append(self._shared["times"][:, COMPUTE].copy())
+        self.comm_time.append(self._shared["times"][:, COMM].copy())
+
+        self.status_counts["S"] -= len(new_infections)
+        self.status_counts["I"] += len(new_infections) - len(recovered) - len(dead)
+        self.status_counts["R"] += len(recovered)
+        self.status_counts["D"] += len(dead)
+        self.time_step += 1
+        self.history.append(tuple(self.status_counts.values()))
+        return new_infections, recovered, dead
+
+    def timing_summary(self):
+        """Seconds per tick spent computing and communicating (mean over workers), and the
+        share of the workers' tick time that went to communication"""
+        if not self.compute_time:
+            return {"ticks": 0, "compute": 0.0, "comm": 0.0, "comm_fraction": 0.0}
+        compute, comm = np.array(self.compute_time), np.array(self.comm_time)
+        return {"ticks": len(compute), "workers": self.workers,
+                "compute": float(compute.mean(axis=1).mean()), "comm": float(comm.mean(axis=1).mean()),
+                "comm_fraction": float(comm.sum() / (comm.sum() + compute.sum())),
+                "boundary_events": self.boundary_events,
+                "ghost_nodes": int(self.ghosts.sum())}
+
+    def _wait_for_workers(self):
+        """Wait until every worker has finished the tick, ShardError if one failed or died"""
+        pending = set(self._pipes)
+        sentinels = {process.sentinel for process in self._processes}
+        while pending:
+            ready = multiprocessing.connection.wait(list(pending) + list(sentinels))
+            failed = any(sentinel in sentinels for sentinel in ready)
+            error = None
+            for pipe in pending.intersection(ready):
+                pending.discard(pipe)
+                try:
+                    error = pipe.recv() or error
+                except (EOFError, OSError):
+                    failed = True
+            if failed or error is not None:
+                error = error or self._worker_error()
+                # the others may be stuck at the exchange barrier waiting for the failed one
+                self._exchange.abort()
+                raise ShardError(error)
+
+    def _worker_error(self):
+        """The error a worker reported, or which worker died and how"""
+        for pipe in self._pipes:
+            try:
+                while pipe.poll():
+                    message = pipe.recv()
+                    if message is not None:
+                        return message
+            except (EOFError, OSError):
+                pass
+        for index, process in enumerate(self._processes):
+            if process.exitcode:  # negative: killed by that signal
+                return f"shard {index} exited with code {process.exitcode}"
+        return "a shard worker stopped"
+
+    def close(self):
+        """Stop the workers and hand the state back to the population's own columns"""
+        if self._closed:
+            return
+        self._closed = True
+        self._exchange.abort()  # lets workers stuck at the exchange after a failed tick out
+        for pipe in self._pipes:
+            try:
+                pipe.send((CMD_STOP, 0))
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for pipe in self._pipes:
+            pipe.close()
+        self.population.status[:] = self.status
+        self.population.last_infected_timestep[:] = self.last_infected_timestep
+        self.status = self.population.status
+        self.last_infected_timestep = self.population.last_infected_timestep
+        self.transmit_factor = self.transmit_factor.copy()
+        self.receive_factor = self.receive_factor.copy()
+        self._shared = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _run_shard(spec, index, seed, mortality_rate, base_prob, exchange, pipe):
+    shm, shared = attach_arrays(spec)
+    try:
+        _shard_loop(shared, index, seed, mortality_rate, base_prob, exchange, pipe)
+    except (threading.BrokenBarrierError, EOFError):
+        pass  # someone else failed, or the main process went away
+    except Exception as e:
+        try:
+            pipe.send(f"shard {index}: {type(e).__name__}: {e}")
+        except OSError:
+            pass
+        exchange.abort()
+    finally:
+        shared = None
+        shm.close()
+
+
+def _shard_loop(shared, index, seed, mortality_rate, base_prob, exchange, pipe):
+    population = AgentPopulation.from_columns(shared)
+    engine = KeyedStepEngine(population, seed=seed, mortality_rate=mortality_rate, base_prob=base_prob)
+    engine.transmit_factor, engine.receive_factor = shared["transmit_factor"], shared["receive_factor"]
+    bounds = shared["bounds"]
+    lo, hi = int(bounds[index]), int(bounds[index + 1])
+    workers = len(bounds) - 1
+    box_start = int(shared["ghost_start"][index])
+    outbox, offsets = shared["outbox"], shared["outbox_offsets"]
+    events, stats, times = shared["events"], shared["stats"], shared["times"]
+    status, last_infected = engine.status, engine.last_infected_timestep
+
+    while True:
+        command, t = pipe.recv()
+        if command == CMD_STOP:
+            return
+        engine.time_step = t
+        start = time.perf_counter()
+
+        infected = lo + np.flatnonzero(status[lo:hi] == INFECTED)
+        targets = engine.transmissions(infected)
+        local = (targets >= lo) & (targets < hi)
+        remote = targets[~local]  # sorted, so already grouped by owner
+        outbox[box_start:box_start + len(remote)] = remote
+        offsets[index] = box_start + np.searchsorted(remote, bounds)
+        compute = time.perf_counter() - start
+
+        start = time.perf_counter()
+        exchange.wait()
+        inbox = [outbox[offsets[sender, index]:offsets[sender, index + 1]] for sender in range(workers) if sender != index]
+        comm = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = np.unique(np.concatenate([targets[local]] + inbox))
+        new = new[status[new] == SUSCEPTIBLE]
+        status[new] = INFECTED
+        last_infected[new] = t
+
+        done = infected[t - last_infected[infected] >= engine.recovery_time[infected]]
+        dies = engine.deaths(done)
+        dead, recovered = done[dies], done[~dies]
+        status[dead] = DEAD
+        status[recovered] = RECOVERED
+
+        # each agent makes at most one transition a tick, so the shard's range of events is big enough
+        transitions = np.concatenate((new, recovered, dead))
+        events[lo:lo + len(transitions)] = transitions
+        stats[index] = len(new), len(recovered), len(dead), len(remote)
+        times[index] = compute + time.perf_counter() - start, comm
+        pipe.send(None)
@@ -0,0 +1,32 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def share_arrays(arrays):
+    """Copy a dict of arrays into one shared memory block.
+
+    Returns (shm, spec). spec is a small picklable description that other processes
+    pass to attach_arrays to get zero-copy views of the same arrays. The creator owns
+    the block and has to close() and unlink() it when everyone is done.
+    """
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        offset = (offset + 63) // 64 * 64  # keep every array cache line aligned
+        layout.append((name, array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (name, dtype, shape, start), array in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)[...] = array
+    return shm, {"name": shm.name, "layout": layout}
+
+
+def attach_arrays(spec):
+    """Open a block made by share_arrays, returns (shm, dict of arrays backed by it)"""
+    # processes started by multiprocessing share the creator's resource tracker, so
+    # attaching does not take ownership away from the creator
+    shm = shared_memory.SharedMemory(name=spec["name"])
+    arrays = {name: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+              for name, dtype, shape, start in spec["layout"]}
+    return shm, arrays
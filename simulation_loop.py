@@ -1,15 +1,27 @@
 import pygame
-import random
-import networkx as nx
-import matplotlib.pyplot as plt
 import multiprocessing
-from multiprocessing import Queue
 import numpy as np
 import platform
+import time
+import layout
+import profiling
+from agent import DEAD, INFECTED, STATUS_NAMES
+from camera import Camera
+from metrics import EpidemicMetrics
+from plot_channel import RingReader, SampleRing
+from recorder import Recorder
+from renderer import GraphRenderer
+from spatial_index import GridIndex
+from simulation_worker import SimulationWorker
+from step_engine import COMPACT_DEAD_FRACTION, FrontierStepEngine
 
 # Define the plotting process function
-def run_plot_process(data_queue):
-    """Run the plotting process separately from the main simulation"""
+def run_plot_process(ring_spec, ready, backlog, cursor):
+    """Run the plotting process separately from the main simulation.
+
+    backlog holds the (time, S, I, R, D, incidence, Rt) samples taken before the window was
+    opened, everything after that is read from the shared ring starting at cursor.
+    """
     import matplotlib
     
     # Use a better backend for macOS
@@ -20,78 +32,79 @@ def run_plot_process(data_queue):
         
     import matplotlib.pyplot as plt
     
+    reader = RingReader(ring_spec, ready, cursor)
+    samples = [backlog]
+    
     # Set up the figure
     plt.ion()  # Interactive mode
-    fig = plt.figure(figsize=(8, 6))
-    ax = fig.add_subplot(111)
-    
-    # Initial empty data
-    time_points = [0]
-    susceptible_data = [0]
-    infected_data = [0]
-    recovered_data = [0]
-    dead_data = [0]
+    fig = plt.figure(figsize=(8, 8))
+    ax = fig.add_subplot(211)
     
     # Initial plot lines
-    s_line, = ax.plot(time_points, susceptible_data, 'g-', label='Susceptible')
-    i_line, = ax.plot(time_points, infected_data, 'r-', label='Infected')
-    r_line, = ax.plot(time_points, recovered_data, 'b-', label='Recovered')
-    d_line, = ax.plot(time_points, dead_data, 'k-', label='Dead')
+    s_line, = ax.plot([], [], 'g-', label='Susceptible')
+    i_line, = ax.plot([], [], 'r-', label='Infected')
+    r_line, = ax.plot([], [], 'b-', label='Recovered')
+    d_line, = ax.plot([], [], 'k-', label='Dead')
     
     ax.set_xlabel('Time')
     ax.set_ylabel('Population')
     ax.set_title('Disease Progression')
     ax.legend()
+
+    # Daily new infections and the effective reproduction number (own axis, 1 marked)
+    incidence_ax = fig.add_subplot(212, sharex=ax)
+    rt_ax = incidence_ax.twinx()
+    incidence_line, = incidence_ax.plot([], [], 'm-', label='New infections')
+    rt_line, = rt_ax.plot([], [], 'c-', label='Rt')
+    rt_ax.axhline(1.0, color='c', linestyle=':', linewidth=1)
+    incidence_ax.set_xlabel('Time')
+    incidence_ax.set_ylabel('New infections per day')
+    rt_ax.set_ylabel('Rt')
+    incidence_ax.legend(handles=[incidence_line, rt_line], loc='upper right')
+    fig.tight_layout()
     
     plt.show(block=False)
     print("Plot window should be visible now")
     
-    # Main loop to receive data
-    running = True
-    while running:
-        try:
-            # Get new data with timeout
-            message = data_queue.get(timeout=0.1)
-            
-            if message[0] == "update":
-                # Unpack data
-                _, t_data, s_data, i_data, r_data, d_data = message
-                
-                # Update data
-                time_points = t_data
-                susceptible_data = s_data
-                infected_data = i_data
-                recovered_data = r_data
-                dead_data = d_data
+    # Main loop, sleeps until the simulation appends samples. The timeout only keeps the
+    # window responsive (it still needs its GUI events pumped while no data comes in)
+    new_data = True
+    try:
+        while plt.fignum_exists(fig.number):
+            if new_data:
+                new_rows = reader.read()
+                if len(new_rows):
+                    samples.append(new_rows)
+                data = np.concatenate(samples)
+                samples = [data]
                 
                 # Update plot lines
-                s_line.set_data(time_points, susceptible_data)
-                i_line.set_data(time_points, infected_data)
-                r_line.set_data(time_points, recovered_data)
-                d_line.set_data(time_points, dead_data)
+                s_line.set_data(data[:, 0], data[:, 1])
+                i_line.set_data(data[:, 0], data[:, 2])
+                r_line.set_data(data[:, 0], data[:, 3])
+                d_line.set_data(data[:, 0], data[:, 4])
+                incidence_line.set_data(data[:, 0], data[:, 5])
+                rt_line.set_data(data[:, 0], data[:, 6])
                 
                 # Rescale axes
-                ax.relim()
-                ax.autoscale_view()
+                for axis in (ax, incidence_ax, rt_ax):
+                    axis.relim()
+                    axis.autoscale_view()
                 
                 # Redraw
                 fig.canvas.draw_idle()
-                fig.canvas.flush_events()
-                
-            elif message[0] == "close":
-                running = False
-                
-        except Exception as e:
-            # Just continue if no new data or other error
-            pass
-            
-        # Check if figure still exists
-        if not plt.fignum_exists(fig.number):
-            running = False
-    
-    plt.close(fig)
+            if reader.closed:
+                break
+            fig.canvas.flush_events()
+            new_data = reader.wait(timeout=0.1)
+    finally:
+        if reader.lost:
+            print(f"Plot fell behind, {reader.lost} samples were dropped")
+        reader.detach()
+        plt.close(fig)
 
-def run_visualization(agents, width=1024, height=768, fps=60):
+def run_visualization(agents, width=1024, height=768, fps=60, seed=None, record_dir=None,
+                      profile=False, trace_path=None):
     # Set multiprocessing start method to spawn for all platforms, especially important for macOS
     if platform.system() == 'Darwin' and multiprocessing.get_start_method() != 'spawn':
         try:
@@ -115,6 +128,14 @@ def run_visualization(agents, width=1024, height=768, fps=60):
     clock = pygame.time.Clock()
     font = pygame.font.SysFont('Arial', 16)
 
+    # Phase timings: P toggles the overlay (profiling runs while it is shown), T exports a trace.
+    # With trace_path profiling runs the whole time and the trace is written on exit
+    show_profile = profile
+    if profile or trace_path:
+        profiling.enable()
+    profile_summary = {}
+    profile_summary_at = 0
+
     # Parameters for simulation
     initial_infection_rate = 0.05
     min_recovery_time = 10
@@ -122,13 +143,8 @@ def run_visualization(agents, width=1024, height=768, fps=60):
     mortality_rate = 0.05
     time_step = 0
     simulation_paused = False
-    zoom_level = 1.0
-    simulation_speed = 1
     step_delay = 500  # milliseconds between steps 
-    last_step_time = 0
-    
-    # Create a queue for inter-process communication
-    plot_queue = Queue()
+    fast_mode = False  # step as fast as possible, the view shows the latest completed step
     
     # Start as None, we'll create when user clicks button
     plot_process = None
@@ -136,7 +152,8 @@ def run_visualization(agents, width=1024, height=768, fps=60):
 
     # Initialize infections
     num_initial_infected = int(len(agents) * initial_infection_rate)
-    initial_infected = random.sample(list(agents.keys()), num_initial_infected)
+    rng = np.random.default_rng(seed)
+    initial_infected = rng.choice(len(agents), num_initial_infected, replace=False)
     
     # Keeping track of status
     status_counts = {
@@ -152,6 +169,8 @@ def run_visualization(agents, width=1024, height=768, fps=60):
     infected_data = [status_counts["I"]]
     recovered_data = [status_counts["R"]]
     dead_data = [status_counts["D"]]
+    incidence_data = [0]
+    rt_data = [np.nan]
 
     # Function to open plot in separate process
     def open_plot_window():
@@ -163,13 +182,14 @@ def run_visualization(agents, width=1024, height=768, fps=60):
             
         try:
             # Create and start process
-            plot_process = multiprocessing.Process(target=run_plot_process, args=(plot_queue,))
+            # Samples taken so far are handed over once at startup, the ring carries the rest
+            backlog = np.column_stack((time_points, susceptible_data, infected_data, recovered_data, dead_data,
+                                       incidence_data, rt_data))
+            plot_process = multiprocessing.Process(target=run_plot_process,
+                                                   args=(plot_ring.spec, plot_ring.ready, backlog, plot_ring.count))
             plot_process.daemon = True
             plot_process.start()
             plot_window_open = True
-            
-            # Send initial data
-            plot_queue.put(("update", time_points, susceptible_data, infected_data, recovered_data, dead_data))
         except Exception as e:
             print(f"Error starting plot process: {e}")
             plot_window_open = False
@@ -196,380 +216,473 @@ def run_visualization(agents, width=1024, height=768, fps=60):
         # Return both the hover state and the button rect as a tuple
         return (hovered and mouse_clicked, button_rect)
 
-    # Your existing zoom function
+    # Zoom centered around the mouse pointer, only the camera changes (agent positions stay in world space)
     def zoom_at_mouse(mouse_x, mouse_y, zoom_delta):
-        nonlocal zoom_level
-        old_zoom = zoom_level
-        zoom_level += zoom_delta
-        
-        # Limiting zoom level
-        zoom_level = max(0.2, min(8.0, zoom_level))
-        
-        # Calculating zoom factor
-        zoom_factor = zoom_level / old_zoom
-        
-        # Updating positions centered around mouse pointer
-        for agent_id in list(agents.keys()):
-            if agent_id in agents:
-                # Get current position
-                current_pos = agents[agent_id].pos
-                
-                # Calculate vector from mouse to agent
-                dx = current_pos[0] - mouse_x
-                dy = current_pos[1] - mouse_y
-                
-                # Scale vector by zoom factor
-                new_dx = dx * zoom_factor
-                new_dy = dy * zoom_factor
-                
-                # Calculate new position
-                new_x = mouse_x + new_dx
-                new_y = mouse_y + new_dy
-                
-                # Update agent position
-                agents[agent_id].pos = (new_x, new_y)
+        camera.zoom_at(mouse_x, mouse_y, camera.scale + zoom_delta)
 
     # Function to find agent under mouse cursor
     def get_agent_under_cursor(mouse_pos):
-        for agent_id, agent in agents.items():
-            # Calculate distance from mouse to agent center
-            distance = ((agent.pos[0] - mouse_pos[0])**2 + (agent.pos[1] - mouse_pos[1])**2)**0.5
-            # Check if mouse is within the agent's circle
-            if distance <= max(1, int(1 * zoom_level)):  # Changed from 3 to 2
-                return agent
+        # Only the grid cells around the cursor are searched, in world space so the index never goes stale
+        x, y = camera.screen_to_world(*mouse_pos)
+        radius = max(1, int(1 * camera.scale)) / camera.scale
+        agent_id = picker.query_point(x, y, radius, status=frame.status)
+        if agent_id is not None:
+            return agents[agent_id]
         return None
 
-    # Initialize agents with infection
-    for nodes in initial_infected:
-        agents[nodes].infect(0)
-
-    # Create NetworkX graph (to visualize the population)
-    G = nx.Graph()
-    for agent_id, agent_obj in agents.items():
-        G.add_node(agent_id, cluster=agent_obj.cluster)
-        for neighbor in agent_obj.neighbours:
-            G.add_edge(agent_id, neighbor)
-
-    # Calculating initial layout
-    positions = nx.spring_layout(G, iterations=100)
-    max_x = max(pos[0] for pos in positions.values()) or 1
-    min_x = min(pos[0] for pos in positions.values()) or 0
-    max_y = max(pos[1] for pos in positions.values()) or 1
-    min_y = min(pos[1] for pos in positions.values()) or 0
-
-    # Storing base positions
-    base_positions = {}
-    for agent_id, pos in positions.items():
-        scaled_x = (pos[0] - min_x) / (max_x - min_x) * (width - 100) + 50
-        scaled_y = (pos[1] - min_y) / (max_y - min_y) * (height - 100) + 50
-        base_positions[agent_id] = (scaled_x, scaled_y)
-        agents[agent_id].pos = (scaled_x, scaled_y)
-    
+    # Function to find the living agents inside a dragged rectangle
+    def get_agents_in_rect(start, end):
+        ids = picker.query_rect(*camera.screen_to_world(*start), *camera.screen_to_world(*end))
+        return np.sort(ids[frame.status[ids] != DEAD])
+
+    # Initialize agents with infection, the step engine owns all dynamic state from here on
+    engine = FrontierStepEngine(agents, mortality_rate=mortality_rate, rng=rng,
+                                compact_dead_fraction=COMPACT_DEAD_FRACTION)
+    engine.infect(initial_infected, 0)
+
+    # Counts, incidence, Rt, attack rate... kept up to date by the worker from every step's transitions
+    metrics = EpidemicMetrics(engine)
+    plotted_rows = 1  # metrics.rows already looked at for the plot, the first one is the initial state
+
+    # Edges to visualize the population, dead agents and their edges are skipped when drawing
+    edge_u, edge_v = agents.edges()
+    graph_renderer = GraphRenderer(edge_u, edge_v)
+
+    # Calculating initial layout (cluster centroids first, then members), cached on disk per graph
+    positions = layout.cached_layout(agents)
+
+    # Storing world positions in the population's pos column, scaled to the initial window. They are
+    # never changed afterwards, zoom and pan go through the camera
+    agents.pos[:] = positions * (width - 100, height - 100) + 50
+    camera = Camera()
+
+    # Grid index over the world positions for hover picking and region selection
+    picker = GridIndex()
+    picker.build(agents.pos)
+    selection = np.empty(0, dtype=np.int64)  # ids of the selected agents
+    drag_start = None
+    pan_from = None  # last mouse position while dragging the view
+    panned = False
+
     # Initialize button state variables
     show_graph_button_rect = None
 
-    # Main simulation loop
-    running = True
-    clicked = False
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    simulation_paused = not(simulation_paused)
-                elif event.key == pygame.K_UP:
-                    step_delay = max(50, step_delay - 50)  # Faster (lower delay)
-                elif event.key == pygame.K_DOWN:
-                    step_delay = min(2000, step_delay + 50)  # Slower (higher delay)
-                elif event.key == pygame.K_ESCAPE:
-                    running = False  # Exit on ESC key
-                elif event.key == pygame.K_f:
-                    # Toggle between fullscreen and windowed mode
-                    if screen.get_flags() & pygame.FULLSCREEN:
-                        # Switch to windowed
-                        screen = pygame.display.set_mode((width, height), pygame.RESIZABLE)
-                    else:
-                        # Switch to fullscreen
-                        screen = pygame.display.set_mode((screen_info.current_w, screen_info.current_h), pygame.FULLSCREEN)
-                        width, height = screen_info.current_w, screen_info.current_h
-            elif event.type == pygame.VIDEORESIZE:
-                # Handle window resize
-                width, height = event.size
-                screen = pygame.display.set_mode((width, height), pygame.RESIZABLE)
-            elif event.type == pygame.MOUSEWHEEL:
-                # Handle zoom with mouse wheel
-                mouse_x, mouse_y = pygame.mouse.get_pos()
-                zoom_delta = event.y * 0.1  # Adjust sensitivity
-                zoom_at_mouse(mouse_x, mouse_y, zoom_delta)
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:  # Left click
-                    if show_graph_button_rect and show_graph_button_rect.collidepoint(event.pos):
-                        print("Button clicked - opening plot")
-                        if not plot_window_open:
-                            open_plot_window()
-                clicked = True
-            elif event.type == pygame.MOUSEBUTTONUP:
-                clicked = False
-        
-        current_time = pygame.time.get_ticks()
-        if not simulation_paused:
-            # Only update if enough time has passed
-            if current_time - last_step_time > step_delay / simulation_speed:
-                new_infections = []
-                # Handling infections
-                for agent in agents.values():
-                    if agent.status == "I":
-                        # Attempt to infect
-                        for neighbour_id in agent.decide_to_infect_neighbours():
-                            if neighbour_id in agents and agents[neighbour_id].status == "S":
-                                if agent.attempt_to_infect_neighbour(agents[neighbour_id], time_step):
-                                    new_infections.append(neighbour_id)
-                status_counts["S"] -= len(new_infections)
-                status_counts["I"] += len(new_infections)
-
-                # Handling deaths and recovery
-                for agent in agents.values():
-                    previous_status = agent.status
-                    if agent.status == "I" and (time_step - agent.last_infected_timestep) >= agent.recovery_time:
-                        # Use the agent's individual recovery time instead of the global one
-                        if random.random() < mortality_rate:
-                            agent.status = "D"
+    # The engine steps in a worker thread, every frame draws the latest snapshot it published.
+    # It starts only now that everything is set up, so the first frame shows step 0
+    # Optionally every step's aggregates are streamed to disk (see recorder.py)
+    recorder = Recorder(record_dir, engine, metrics=metrics) if record_dir is not None else None
+    worker = SimulationWorker(engine, step_delay, recorder=recorder, metrics=metrics)
+
+    # Shared memory ring for (time, S, I, R, D, incidence, Rt) plot samples, only new samples go to the plot process
+    # (float, for Rt). Created last, the teardown below is what releases it
+    plot_ring = SampleRing(columns=7, dtype=np.float64)
+    worker.start()
+
+    # Main simulation loop, the teardown in finally runs however it is left (quit, ESC, a worker error)
+    try:
+        running = True
+        clicked = False
+        while running:
+            if worker.error is not None:
+                raise worker.error
+            lap = profiling.laps("frame")
+            frame = worker.acquire()
+            time_step = frame.time_step
+            status_counts.update(frame.metrics["counts"])
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_SPACE:
+                        simulation_paused = not(simulation_paused)
+                        worker.set_paused(simulation_paused)
+                    elif event.key == pygame.K_UP:
+                        step_delay = max(50, step_delay - 50)  # Faster (lower delay)
+                        fast_mode = False
+                        worker.set_step_delay(step_delay)
+                    elif event.key == pygame.K_DOWN:
+                        step_delay = min(2000, step_delay + 50)  # Slower (higher delay)
+                        fast_mode = False
+                        worker.set_step_delay(step_delay)
+                    elif event.key == pygame.K_m:
+                        # Toggle unthrottled stepping
+                        fast_mode = not fast_mode
+                        worker.set_step_delay(0 if fast_mode else step_delay)
+                    elif event.key == pygame.K_p:
+                        # Toggle the profiling overlay
+                        show_profile = not show_profile
+                        if show_profile:
+                            profiling.enable()
+                        elif not trace_path:
+                            profiling.disable()
+                    elif event.key == pygame.K_t:
+                        # Export the buffered phase timings as a Chrome trace
+                        path = f"trace-{time.strftime('%Y%m%d-%H%M%S')}.json"
+                        count = profiling.PROFILER.export_chrome_trace(path)
+                        print(f"Wrote {count} trace events to {path}")
+                    elif event.key == pygame.K_ESCAPE:
+                        running = False  # Exit on ESC key
+                    elif event.key == pygame.K_f:
+                        # Toggle between fullscreen and windowed mode
+                        if screen.get_flags() & pygame.FULLSCREEN:
+                            # Switch to windowed
+                            screen = pygame.display.set_mode((width, height), pygame.RESIZABLE)
                         else:
-                            agent.status = "R"
-                        
-                        if agent.status != previous_status:
-                            status_counts[previous_status] -= 1
-                            status_counts[agent.status] += 1
-                            if agent.status == "D":  # Removing dead nodes from simulation
-                                if agent.id in base_positions:
-                                    del base_positions[agent.id]
-                
-                # Update time step and last update time
-                time_step += 1
-                last_step_time = current_time
-                
-                # Collect data for plot every 5 steps
-                if time_step % 5 == 0:
-                    time_points.append(time_step)
-                    susceptible_data.append(status_counts["S"])
-                    infected_data.append(status_counts["I"])
-                    recovered_data.append(status_counts["R"])
-                    dead_data.append(status_counts["D"])
-                    
-                    # Send update if process is running
-                    if plot_window_open and plot_process is not None and plot_process.is_alive():
-                        try:
-                            plot_queue.put(("update", time_points, susceptible_data, infected_data, recovered_data, dead_data))
-                        except:
-                            pass
-        
-        # Drawing directly in main loop
-        screen.fill((30, 30, 30))
-        
-        # Drawing edges
-        for agent in list(agents.values()):
-            if agent.status == "D":
-                del agents[agent.id]
-                continue
-            for nid in agent.neighbours:
-                if nid > agent.id and nid in agents and agents[nid].status != "D":  # Avoid duplicates
-                    pygame.draw.aaline(screen, (150,150,150), 
-                                     (int(agent.pos[0]), int(agent.pos[1])),
-                                     (int(agents[nid].pos[0]), int(agents[nid].pos[1])))
-
-        # Drawing nodes
-        for agent in agents.values():
-            color = (
-                (40,40,40) if agent.status == "D" else
-                (200,0,0) if agent.status == "I" else
-                (0,0,200) if agent.status == "R" else
-                (0,200,0)
-            )
-            pygame.draw.circle(screen, color, 
-                 (int(agent.pos[0]), int(agent.pos[1])), 
-                 max(1, int(1 * zoom_level)))  # Changed from 3 to 2
-        
-        # Check for agent under mouse cursor and display info
-        mouse_pos = pygame.mouse.get_pos()
-        hovered_agent = get_agent_under_cursor(mouse_pos)
-        if hovered_agent:
-            # Prepare info texts
-            info_texts = [
-                f"Agent ID: {hovered_agent.id}",
-                f"Status: {hovered_agent.status}",
-                f"Connections: {len(hovered_agent.neighbours)}",
-                f"Cluster: {hovered_agent.cluster}",
-                f"Recovery Time: {hovered_agent.recovery_time} days"
-            ]
+                            # Switch to fullscreen
+                            screen = pygame.display.set_mode((screen_info.current_w, screen_info.current_h), pygame.FULLSCREEN)
+                            width, height = screen_info.current_w, screen_info.current_h
+                elif event.type == pygame.VIDEORESIZE:
+                    # Handle window resize
+                    width, height = event.size
+                    screen = pygame.display.set_mode((width, height), pygame.RESIZABLE)
+                elif event.type == pygame.MOUSEWHEEL:
+                    # Handle zoom with mouse wheel
+                    mouse_x, mouse_y = pygame.mouse.get_pos()
+                    zoom_delta = event.y * 0.1  # Adjust sensitivity
+                    zoom_at_mouse(mouse_x, mouse_y, zoom_delta)
+                elif event.type == pygame.MOUSEBUTTONDOWN:
+                    if event.button == 1:  # Left click
+                        if show_graph_button_rect and show_graph_button_rect.collidepoint(event.pos):
+                            print("Button clicked - opening plot")
+                            if not plot_window_open:
+                                open_plot_window()
+                        elif pygame.key.get_mods() & pygame.KMOD_SHIFT:
+                            drag_start = event.pos  # Start a region selection
+                        else:
+                            # Dragging pans the view, a click without moving selects (see MOUSEBUTTONUP)
+                            pan_from = event.pos
+                            panned = False
+                    elif event.button == 3:  # Right click
+                        selection = np.empty(0, dtype=np.int64)
+                    clicked = True
+                elif event.type == pygame.MOUSEMOTION:
+                    if pan_from is not None:
+                        dx, dy = event.pos[0] - pan_from[0], event.pos[1] - pan_from[1]
+                        # Small jitter while clicking should not count as a drag
+                        if panned or abs(dx) + abs(dy) > 3:
+                            camera.pan(dx, dy)
+                            pan_from = event.pos
+                            panned = True
+                elif event.type == pygame.MOUSEBUTTONUP:
+                    if event.button == 1 and drag_start is not None:
+                        selection = get_agents_in_rect(drag_start, event.pos)
+                        drag_start = None
+                    elif event.button == 1 and pan_from is not None:
+                        if not panned:
+                            # Click selects the agent under the cursor (or clears on empty space)
+                            picked = get_agent_under_cursor(event.pos)
+                            selection = np.array([picked.id] if picked else [], dtype=np.int64)
+                        pan_from = None
+                    clicked = False
+        
+            lap("events")
+
+            # Collect data for plot every 5 steps, from the metrics rows so no step is missed
+            # when the worker runs ahead of the display (rows are only ever appended)
+            new_rows = metrics.rows[plotted_rows:]
+            new_samples = []
+            for step, s, i, r, d, incidence, rt in new_rows:
+                if step % 5 == 0:
+                    time_points.append(step)
+                    susceptible_data.append(s)
+                    infected_data.append(i)
+                    recovered_data.append(r)
+                    dead_data.append(d)
+                    incidence_data.append(incidence)
+                    rt_data.append(rt)
+                    new_samples.append((step, s, i, r, d, incidence, rt))
+            plotted_rows += len(new_rows)
+
+            # Publish to the plot process (if it is not running the samples are only kept for its backlog)
+            if new_samples:
+                plot_ring.append(new_samples)
+            lap("plot")
+        
+            # Drawing edges (cached layer, includes the background) and nodes (batched per status color)
+            status = frame.status
+            screen_pos = camera.world_to_screen(agents.pos)
+            # the renderer tells pans from zooms by the view, a pan only shifts the edge layer until the drag ends
+            graph_renderer.draw(screen, screen_pos, status, max(1, int(1 * camera.scale)),
+                                view=(camera.scale, camera.offset), moving=pan_from is not None and panned)
+            lap("graph")
+
+            # Outline the selected agents that are still alive (capped, a huge selection would just cover the screen)
+            selected_alive = selection[status[selection] != DEAD]
+            selection_radius = max(2, int(2 * camera.scale))
+            for agent_id in selected_alive[:2000].tolist():
+                pygame.draw.circle(screen, (255, 255, 0), screen_pos[agent_id].tolist(), selection_radius, 1)
+
+            # Draw the selection rectangle while dragging
+            if drag_start is not None:
+                mx, my = pygame.mouse.get_pos()
+                drag_rect = pygame.Rect(min(drag_start[0], mx), min(drag_start[1], my),
+                                        abs(mx - drag_start[0]), abs(my - drag_start[1]))
+                pygame.draw.rect(screen, (255, 255, 0), drag_rect, 1)
+            lap("selection")
+
+            # Check for agent under mouse cursor and display info
+            mouse_pos = pygame.mouse.get_pos()
+            hovered_agent = get_agent_under_cursor(mouse_pos)
+            if hovered_agent:
+                # Prepare info texts
+                info_texts = [
+                    f"Agent ID: {hovered_agent.id}",
+                    f"Status: {STATUS_NAMES[frame.status[hovered_agent.id]]}",
+                    f"Connections: {len(hovered_agent.neighbours)}",
+                    f"Cluster: {hovered_agent.cluster}",
+                    f"Recovery Time: {hovered_agent.recovery_time} days"
+                ]
             
-            # Display infection time if infected
-            if hovered_agent.status == "I" and hasattr(hovered_agent, 'last_infected_timestep'):
-                days_infected = time_step - hovered_agent.last_infected_timestep
-                days_left = hovered_agent.recovery_time - days_infected
-                info_texts.append(f"Days Infected: {days_infected}")
-                info_texts.append(f"Days Until Recovery: {days_left}")
+                # Display infection time if infected
+                if frame.status[hovered_agent.id] == INFECTED:
+                    days_infected = time_step - frame.last_infected_timestep[hovered_agent.id]
+                    days_left = hovered_agent.recovery_time - days_infected
+                    info_texts.append(f"Days Infected: {days_infected}")
+                    info_texts.append(f"Days Until Recovery: {days_left}")
             
-            # Calculate dynamic height based on content
-            line_height = 20
-            padding = 20  # Top and bottom padding
-            info_width = 200
-            info_height = len(info_texts) * line_height + padding
+                # Calculate dynamic height based on content
+                line_height = 20
+                padding = 20  # Top and bottom padding
+                info_width = 200
+                info_height = len(info_texts) * line_height + padding
             
-            # Position panel near mouse but keep within screen boundaries
-            panel_x = min(width - info_width - 10, mouse_pos[0] + 10)
-            panel_y = min(height - info_height - 10, mouse_pos[1] + 10)
+                # Position panel near mouse but keep within screen boundaries
+                panel_x = min(width - info_width - 10, mouse_pos[0] + 10)
+                panel_y = min(height - info_height - 10, mouse_pos[1] + 10)
             
-            # Draw semi-transparent background
-            s = pygame.Surface((info_width, info_height), pygame.SRCALPHA)
-            s.fill((0, 0, 0, 180))  # Black with 70% opacity
-            screen.blit(s, (panel_x, panel_y))
+                # Draw semi-transparent background
+                s = pygame.Surface((info_width, info_height), pygame.SRCALPHA)
+                s.fill((0, 0, 0, 180))  # Black with 70% opacity
+                screen.blit(s, (panel_x, panel_y))
             
-            # Draw border
-            pygame.draw.rect(screen, (200, 200, 200), (panel_x, panel_y, info_width, info_height), 1)
+                # Draw border
+                pygame.draw.rect(screen, (200, 200, 200), (panel_x, panel_y, info_width, info_height), 1)
             
-            # Render all info texts
-            y_offset = 0
-            for info in info_texts:
-                text_surf = font.render(info, True, (255, 255, 255))
-                screen.blit(text_surf, (panel_x + 10, panel_y + 10 + y_offset))
-                y_offset += line_height
+                # Render all info texts
+                y_offset = 0
+                for info in info_texts:
+                    text_surf = font.render(info, True, (255, 255, 255))
+                    screen.blit(text_surf, (panel_x + 10, panel_y + 10 + y_offset))
+                    y_offset += line_height
                 
-            # Highlight the hovered agent
-            highlight_radius = max(2, int(2 * zoom_level))  # Changed from 4 to 3
-            pygame.draw.circle(screen, (255, 255, 255), 
-                             (int(hovered_agent.pos[0]), int(hovered_agent.pos[1])), 
-                             highlight_radius, 2)  # Draw white outline
-        
-        # Draw "Show Graph" button
-        button_x = width - 150
-        button_y = height - 50
-        show_graph_hovered, show_graph_button_rect = draw_button("Show Graph", button_x, button_y, 130, 40)
-
-        # Drawing UI with better layout
-        info_panel_x = 10
-        info_panel_y = 10
-        info_panel_width = 150
-        info_panel_height = 160
-        
-        # Semi-transparent background for status panel
-        status_panel = pygame.Surface((info_panel_width, info_panel_height), pygame.SRCALPHA)
-        status_panel.fill((0, 0, 0, 150))  # Black with opacity
-        screen.blit(status_panel, (info_panel_x, info_panel_y))
-        
-        # Draw border
-        pygame.draw.rect(screen, (150, 150, 150), (info_panel_x, info_panel_y, info_panel_width, info_panel_height), 1)
-        
-        # Status titles
-        y = info_panel_y + 10
-        titles = ["Simulation Status:", f"Time: {time_step}", f"Zoom: {zoom_level:.2f}x"]
-        if simulation_paused:
-            titles.append("PAUSED")
-        
-        for text in titles:
-            screen.blit(font.render(text, True, (255, 255, 255)), (info_panel_x + 10, y))
-            y += 20
-        
-        # Add a separator line
-        pygame.draw.line(screen, (150, 150, 150), 
-                        (info_panel_x + 10, y), 
-                        (info_panel_x + info_panel_width - 10, y), 1)
-        y += 10
-        
-        # Status counts with color indicators
-        status_texts = {
-            "S": "Susceptible",
-            "I": "Infected",
-            "R": "Recovered",
-            "D": "Dead"
-        }
-        status_colors = {
-            "S": (0, 200, 0),    # Green
-            "I": (200, 0, 0),    # Red
-            "R": (0, 0, 200),    # Blue
-            "D": (100, 100, 100) # Gray
-        }
+                # Highlight the hovered agent
+                highlight_radius = max(2, int(2 * camera.scale))  # Changed from 4 to 3
+                pygame.draw.circle(screen, (255, 255, 255), 
+                                 screen_pos[hovered_agent.id].tolist(), 
+                                 highlight_radius, 2)  # Draw white outline
+            lap("hover")
+        
+            # Draw "Show Graph" button
+            button_x = width - 150
+            button_y = height - 50
+            show_graph_hovered, show_graph_button_rect = draw_button("Show Graph", button_x, button_y, 130, 40)
+
+            # Drawing UI with better layout
+            info_panel_x = 10
+            info_panel_y = 10
+            info_panel_width = 170
+            titles = ["Simulation Status:", f"Time: {time_step}", f"Zoom: {camera.scale:.2f}x"]
+            if simulation_paused:
+                titles.append("PAUSED")
+            elif fast_mode and status_counts["I"] == 0:
+                titles.append("FINISHED")
+            # Metrics straight from the snapshot, nothing is recounted here
+            summary = frame.metrics
+            rt = summary["rt"]
+            metric_texts = [f"New today: {summary['incidence']}", f"Rt: {'-' if np.isnan(rt) else f'{rt:.2f}'}",
+                            f"Attack rate: {summary['attack_rate']:.1%}", "Cases / deaths by age:"]
+            metric_texts += [f"  {band}: {cases} / {summary['band_deaths'][band]}"
+                             for band, cases in summary["band_cases"].items()]
+            # grows with the PAUSED / FINISHED line and the metrics section
+            info_panel_height = 110 + 20 * (len(titles) + len(metric_texts))
+        
+            # Semi-transparent background for status panel
+            status_panel = pygame.Surface((info_panel_width, info_panel_height), pygame.SRCALPHA)
+            status_panel.fill((0, 0, 0, 150))  # Black with opacity
+            screen.blit(status_panel, (info_panel_x, info_panel_y))
         
-        for status, count in status_counts.items():
-            # Draw color indicator box
-            pygame.draw.rect(screen, status_colors[status], 
-                            (info_panel_x + 10, y, 10, 10))
+            # Draw border
+            pygame.draw.rect(screen, (150, 150, 150), (info_panel_x, info_panel_y, info_panel_width, info_panel_height), 1)
+        
+            # Status titles
+            y = info_panel_y + 10
+            for text in titles:
+                screen.blit(font.render(text, True, (255, 255, 255)), (info_panel_x + 10, y))
+                y += 20
+        
+            # Add a separator line
+            pygame.draw.line(screen, (150, 150, 150), 
+                            (info_panel_x + 10, y), 
+                            (info_panel_x + info_panel_width - 10, y), 1)
+            y += 10
+        
+            # Status counts with color indicators
+            status_texts = {
+                "S": "Susceptible",
+                "I": "Infected",
+                "R": "Recovered",
+                "D": "Dead"
+            }
+            status_colors = {
+                "S": (0, 200, 0),    # Green
+                "I": (200, 0, 0),    # Red
+                "R": (0, 0, 200),    # Blue
+                "D": (100, 100, 100) # Gray
+            }
+        
+            for status, count in status_counts.items():
+                # Draw color indicator box
+                pygame.draw.rect(screen, status_colors[status], 
+                                (info_panel_x + 10, y, 10, 10))
             
-            # Draw status text
-            status_text = f"{status_texts[status]}: {count}"
-            screen.blit(font.render(status_text, True, (255, 255, 255)), 
-                       (info_panel_x + 25, y - 2))
-            y += 20
-        
-        # Draw controls help in the top-right corner
-        help_panel_x = width - 270  # Position from right edge
-        help_panel_y = 10           # Position from top edge
-        help_panel_width = 250
-        help_panel_height = 100      # Slightly increased height fno zor better spacing
-        
-        # Background
-        help_panel = pygame.Surface((help_panel_width, help_panel_height), pygame.SRCALPHA)
-        help_panel.fill((0, 0, 0, 150))  # Semi-transparent black
-        screen.blit(help_panel, (help_panel_x, help_panel_y))
-        
-        # Border
-        pygame.draw.rect(screen, (150, 150, 150), 
-                       (help_panel_x, help_panel_y, help_panel_width, help_panel_height), 1)
-        
-        # Help text
-        help_texts = [
-            "Controls:",
-            "Space - Pause/Resume",
-            "Up/Down - Adjust Speed",
-            "Mouse Wheel - Zoom In/Out",
-            "ESC - Exit"
-        ]
-        
-        y = help_panel_y + 10
-        for text in help_texts:
-            screen.blit(font.render(text, True, (200, 200, 200)), 
-                       (help_panel_x + 10, y))
-            y += 17
-        
-        # Simulation speed control component - improved layout
-        speed_bar_width = 200
-        speed_bar_height = 30
-        speed_bar_x = 10
-        speed_bar_y = height - 40
-        
-        # Draw background bar
-        pygame.draw.rect(screen, (60, 60, 60), (speed_bar_x, speed_bar_y, speed_bar_width, speed_bar_height))
-        
-        # Draw indicator (limit to bar width)
-        indicator_width = min(speed_bar_width, int(step_delay/10))
-        pygame.draw.rect(screen, (100, 100, 100), (speed_bar_x, speed_bar_y, indicator_width, speed_bar_height))
-        
-        # Create speed text
-        speed_text = f"Speed: {1000/step_delay:.1f} steps/sec"
-        text_surf = font.render(speed_text, True, (255, 255, 255))
-        
-        # Position text centered in the bar
-        text_width, text_height = text_surf.get_size()
-        text_x = speed_bar_x + (speed_bar_width - text_width) // 2
-        text_y = speed_bar_y + (speed_bar_height - text_height) // 2
-        
-        # Draw text
-        screen.blit(text_surf, (text_x, text_y))
+                # Draw status text
+                status_text = f"{status_texts[status]}: {count}"
+                screen.blit(font.render(status_text, True, (255, 255, 255)), 
+                           (info_panel_x + 25, y - 2))
+                y += 20
+
+            # Epidemic metrics under another separator
+            pygame.draw.line(screen, (150, 150, 150),
+                            (info_panel_x + 10, y),
+                            (info_panel_x + info_panel_width - 10, y), 1)
+            y += 8
+            for text in metric_texts:
+                screen.blit(font.render(text, True, (255, 255, 255)), (info_panel_x + 10, y))
+                y += 20
+
+            # Selection panel under the status panel with the status breakdown of the selected agents
+            if len(selection):
+                counts = np.bincount(frame.status[selection], minlength=4)
+                selection_texts = [f"Selected: {len(selection)}"] + [
+                    f"{status_texts[name]}: {count}" for name, count in zip("SIRD", counts.tolist())]
+                selection_panel_y = info_panel_y + info_panel_height + 10
+                selection_panel_height = len(selection_texts) * 20 + 10
+                selection_panel = pygame.Surface((info_panel_width, selection_panel_height), pygame.SRCALPHA)
+                selection_panel.fill((0, 0, 0, 150))
+                screen.blit(selection_panel, (info_panel_x, selection_panel_y))
+                pygame.draw.rect(screen, (255, 255, 0),
+                                 (info_panel_x, selection_panel_y, info_panel_width, selection_panel_height), 1)
+                y = selection_panel_y + 8
+                for text in selection_texts:
+                    screen.blit(font.render(text, True, (255, 255, 255)), (info_panel_x + 10, y))
+                    y += 20
+
+            # Draw controls help in the top-right corner
+            help_panel_x = width - 270  # Position from right edge
+            help_panel_y = 10           # Position from top edge
+            help_panel_width = 250
+            help_panel_height = 199      # Slightly increased height fno zor better spacing
+        
+            # Background
+            help_panel = pygame.Surface((help_panel_width, help_panel_height), pygame.SRCALPHA)
+            help_panel.fill((0, 0, 0, 150))  # Semi-transparent black
+            screen.blit(help_panel, (help_panel_x, help_panel_y))
+        
+            # Border
+            pygame.draw.rect(screen, (150, 150, 150), 
+                           (help_panel_x, help_panel_y, help_panel_width, help_panel_height), 1)
+        
+            # Help text
+            help_texts = [
+                "Controls:",
+                "Space - Pause/Resume",
+                "Up/Down - Adjust Speed",
+                "M - Max Speed On/Off",
+                "P - Profiler, T - Export trace",
+                "Mouse Wheel - Zoom In/Out",
+                "Drag - Pan view",
+                "Click - Select agent",
+                "Shift+Drag - Select region",
+                "Right Click - Clear selection",
+                "ESC - Exit"
+            ]
         
-        pygame.display.flip()
-        clock.tick(fps)
+            y = help_panel_y + 10
+            for text in help_texts:
+                screen.blit(font.render(text, True, (200, 200, 200)), 
+                           (help_panel_x + 10, y))
+                y += 17
+        
+            # Simulation speed control component - improved layout
+            speed_bar_width = 200
+            speed_bar_height = 30
+            speed_bar_x = 10
+            speed_bar_y = height - 40
+        
+            # Draw background bar
+            pygame.draw.rect(screen, (60, 60, 60), (speed_bar_x, speed_bar_y, speed_bar_width, speed_bar_height))
+        
+            # Draw indicator (limit to bar width)
+            indicator_width = speed_bar_width if fast_mode else min(speed_bar_width, int(step_delay/10))
+            pygame.draw.rect(screen, (100, 100, 100), (speed_bar_x, speed_bar_y, indicator_width, speed_bar_height))
+        
+            # Create speed text
+            if fast_mode:
+                speed_text = f"Speed: max ({worker.steps_per_second:.0f} steps/sec)"
+            else:
+                speed_text = f"Speed: {1000/step_delay:.1f} steps/sec"
+            text_surf = font.render(speed_text, True, (255, 255, 255))
+        
+            # Position text centered in the bar
+            text_width, text_height = text_surf.get_size()
+            text_x = speed_bar_x + (speed_bar_width - text_width) // 2
+            text_y = speed_bar_y + (speed_bar_height - text_height) // 2
+        
+            # Draw text
+            screen.blit(text_surf, (text_x, text_y))
+            lap("panels")
 
-    # Clean up before exiting
-    if plot_process is not None and plot_process.is_alive():
-        try:
-            plot_queue.put(("close",))
+            # Profiling overlay next to the status panel: mean and p95 per phase plus a histogram
+            # of the last few hundred timings (log scale from 1 us to 1 s)
+            if show_profile:
+                if pygame.time.get_ticks() - profile_summary_at > 250:
+                    profile_summary = profiling.PROFILER.summary()
+                    profile_summary_at = pygame.time.get_ticks()
+                profile_panel_x = info_panel_x + info_panel_width + 10
+                profile_panel_y = 10
+                profile_panel_width = 390
+                profile_panel_height = 35 + 18 * len(profile_summary)
+                profile_panel = pygame.Surface((profile_panel_width, profile_panel_height), pygame.SRCALPHA)
+                profile_panel.fill((0, 0, 0, 170))
+                screen.blit(profile_panel, (profile_panel_x, profile_panel_y))
+                pygame.draw.rect(screen, (150, 150, 150),
+                                 (profile_panel_x, profile_panel_y, profile_panel_width, profile_panel_height), 1)
+                screen.blit(font.render("Phase", True, (255, 255, 255)), (profile_panel_x + 10, profile_panel_y + 8))
+                screen.blit(font.render("mean / p95 ms", True, (255, 255, 255)), (profile_panel_x + 185, profile_panel_y + 8))
+                y = profile_panel_y + 28
+                for name, stats in profile_summary.items():
+                    timing = f"{stats['mean'] * 1000:.2f} / {stats['p95'] * 1000:.2f}"
+                    screen.blit(font.render(name, True, (200, 200, 200)), (profile_panel_x + 10, y))
+                    screen.blit(font.render(timing, True, (200, 200, 200)), (profile_panel_x + 185, y))
+                    histogram = stats["histogram"]
+                    peak = max(int(histogram.max()), 1)
+                    for b, count in enumerate(histogram.tolist()):
+                        if count:
+                            bar = max(1, 14 * count // peak)
+                            pygame.draw.rect(screen, (230, 160, 40),
+                                             (profile_panel_x + 300 + 3 * b, y + 15 - bar, 2, bar))
+                    y += 18
+        
+            pygame.display.flip()
+            worker.release()
+            lap("flip")
+            clock.tick(fps)
+    finally:
+        worker.stop()
+        if trace_path:
+            count = profiling.PROFILER.export_chrome_trace(trace_path)
+            print(f"Wrote {count} trace events to {trace_path}")
+        if recorder is not None:
+            recorder.close()
+        if plot_process is not None and plot_process.is_alive():
+            plot_ring.close()
             plot_process.join(timeout=1.0)
             if plot_process.is_alive():
                 plot_process.terminate()
-        except:
-            pass
+        plot_ring.release()
     
-    pygame.quit()
+        pygame.quit()
 
 if __name__ == "__main__":
     # Set start method to spawn for better compatibility
@@ -0,0 +1,129 @@
+import threading
+import time
+import numpy as np
+
+
+class Snapshot:
+    """Dynamic state of the population after one completed step, read only for the renderer"""
+
+    def __init__(self, size):
+        self.status = np.zeros(size, dtype=np.int8)
+        self.last_infected_timestep = np.full(size, -1, dtype=np.int32)
+        self.time_step = 0
+        self.status_counts = {}
+        self.metrics = {}
+
+    def fill(self, engine, metrics=None):
+        self.status[:] = engine.status
+        self.last_infected_timestep[:] = engine.last_infected_timestep
+        self.time_step = engine.time_step
+        self.status_counts = dict(engine.status_counts)
+        self.metrics = metrics.summary() if metrics is not None else {}
+
+
+class SimulationWorker(threading.Thread):
+    """Steps a StepEngine in the background and publishes double-buffered snapshots.
+
+    After a step the state is copied into the back buffer and the buffers are swapped,
+    so the render loop always sees a complete step and never waits for one. The buffer
+    the renderer holds (acquire() until release()) is never written; if the worker
+    finishes a step while the renderer still holds the back buffer it just skips
+    publishing that step. step_delay is the pause between steps in milliseconds, 0 runs
+    as fast as possible (and stops once nobody is infected anymore). Every step is
+    also handed to metrics (a metrics.EpidemicMetrics, its summary goes into the
+    snapshots) and to recorder (a recorder.Recorder) if they are given.
+
+    A thread and not a process: the engine, the population columns and engine.history
+    are shared with the render loop without copies, and the heavy lifting in a step is
+    numpy, which releases the GIL.
+    """
+
+    def __init__(self, engine, step_delay=500, paused=False, recorder=None, metrics=None):
+        super().__init__(daemon=True)
+        self.engine = engine
+        self.recorder = recorder
+        self.metrics = metrics
+        self.step_delay = step_delay
+        self.paused = paused
+        self.error = None
+        self.steps_per_second = 0.0
+        self._buffers = [Snapshot(engine.n), Snapshot(engine.n)]
+        self._buffers[0].fill(engine, metrics)
+        self._front = 0
+        self._reading = None
+        self._lock = threading.Lock()
+        self._wake = threading.Condition()
+        self._stopped = False
+
+    def acquire(self):
+        """Latest published snapshot, valid until release()"""
+        with self._lock:
+            self._reading = self._front
+            return self._buffers[self._front]
+
+    def release(self):
+        with self._lock:
+            self._reading = None
+
+    def _publish(self):
+        back = 1 - self._front
+        with self._lock:
+            if self._reading == back:
+                return
+        # the renderer only ever takes the front buffer, so back can be filled without the lock
+        self._buffers[back].fill(self.engine, self.metrics)
+        with self._lock:
+            self._front = back
+
+    def set_paused(self, paused):
+        with self._wake:
+            self.paused = paused
+            self._wake.notify()
+
+    def set_step_delay(self, step_delay):
+        with self._wake:
+            self.step_delay = step_delay
+            self._wake.notify()
+
+    def stop(self):
+        with self._wake:
+            self._stopped = True
+            self._wake.notify()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        # the first step waits step_delay like every other, so step 0 gets shown
+        last_step = time.perf_counter()
+        rate_window, rate_steps = time.perf_counter(), 0
+        try:
+            while True:
+                with self._wake:
+                    while True:
+                        if self._stopped:
+                            return
+                        if self.paused or (self.step_delay == 0 and self.engine.status_counts["I"] == 0):
+                            self._wake.wait()
+                            continue
+                        # a change of the delay (or pause) wakes the wait, so the new setting applies at once
+                        remaining = last_step + self.step_delay / 1000 - time.perf_counter()
+                        if remaining <= 0:
+                            break
+                        self._wake.wait(remaining)
+                last_step = time.perf_counter()
+                transitions = self.engine.step()
+                # metrics first, a recorder built with metrics records its cluster counts
+                if self.metrics is not None:
+                    self.metrics.update(self.engine, transitions)
+                if self.recorder is not None:
+                    self.recorder.record(self.engine, transitions)
+                self._publish()
+
+                rate_steps += 1
+                elapsed = time.perf_counter() - rate_window
+                if elapsed >= 0.5:
+                    self.steps_per_second = rate_steps / elapsed
+                    rate_window, rate_steps = time.perf_counter(), 0
+        except Exception as e:
+            # handed to the render loop, which re-raises it
+            self.error = e
@@ -0,0 +1,87 @@
+import json
+import struct
+import zlib
+import numpy as np
+from population import STATIC_COLUMNS, AgentPopulation
+
+# File layout:
+#   MAGIC (8 bytes) | format version (uint32) | header length (uint32) | JSON header | padding | columns
+# The JSON header holds the generator parameters and, for every column, its dtype, shape,
+# offset from the start of the column data and CRC32. The column data starts at the first
+# 64 byte boundary after the header and every column is 64 byte aligned, so they can be
+# memory mapped directly.
+MAGIC = b"AGPOP\x00\r\n"
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct("<8sII")
+_ALIGN = 64
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def save_population(population, path):
+    """Write the static columns and CSR adjacency of population to path"""
+    columns = {name: np.ascontiguousarray(array) for name, array in population.static_columns().items()}
+    layout = {}
+    offset = 0
+    for name, array in columns.items():
+        offset = _align(offset)
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset,
+                        "crc32": zlib.crc32(array.data)}
+        offset += array.nbytes
+    header = json.dumps({"size": population.size, "generator_params": population.generator_params,
+                         "connectivity_stats": population.connectivity_stats, "columns": layout}).encode()
+    data_start = _align(_PREFIX.size + len(header))
+
+    with open(path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name, array in columns.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.data)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise SnapshotError(f"{path} is too short to be a population snapshot")
+        magic, version, header_length = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a population snapshot")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"{path} has snapshot format {version}, expected {FORMAT_VERSION}")
+        header = json.loads(f.read(header_length))
+    header["data_start"] = _align(_PREFIX.size + header_length)
+    return header
+
+
+def load_population(path, mode="r", verify=False):
+    """Open a snapshot as an AgentPopulation whose static columns are memory mapped.
+
+    Nothing is read up front, so this is fast for any size, and processes that load the
+    same file share its pages through the OS cache. mode is passed to numpy.memmap
+    ("r" read-only, "c" copy-on-write). verify=True checks the CRC32 of every column.
+    """
+    header = read_header(path)
+    columns = {}
+    for name in STATIC_COLUMNS:
+        spec = header["columns"][name]
+        shape = tuple(spec["shape"])
+        if shape[0] == 0:
+            columns[name] = np.empty(shape, dtype=spec["dtype"])
+        else:
+            columns[name] = np.memmap(path, dtype=spec["dtype"], mode=mode,
+                                      offset=header["data_start"] + spec["offset"], shape=shape)
+        if verify and zlib.crc32(columns[name].data) != spec["crc32"]:
+            raise SnapshotError(f"Checksum mismatch in column {name!r} of {path}")
+    population = AgentPopulation.from_columns(columns)
+    population.generator_params = header["generator_params"]
+    population.connectivity_stats = header["connectivity_stats"]
+    population.snapshot_path = path
+    return population
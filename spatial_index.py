@@ -0,0 +1,77 @@
+import numpy as np
+from agent import DEAD
+
+
+class GridIndex:
+    """Uniform grid over 2D points for point (picking) and rectangle queries.
+
+    Points are bucketed into square cells and sorted by cell key, so every cell is a
+    contiguous slice found with a binary search. The index is built once over the world
+    positions (the layout), which zooming and panning never change: callers map screen
+    coordinates to world space (Camera.screen_to_world) before querying.
+    """
+
+    def __init__(self, cell_size=16.0):
+        self.cell_size = float(cell_size)
+        self.positions = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.origin = np.zeros(2, dtype=np.int64)
+        self.rows = 1
+
+    def _cells(self, xy):
+        return np.floor(np.asarray(xy, dtype=np.float64) / self.cell_size).astype(np.int64)
+
+    def build(self, positions):
+        self.positions = np.array(positions, copy=True)
+        if len(positions) == 0:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.keys = np.empty(0, dtype=np.int64)
+            return
+        cells = self._cells(positions)
+        self.origin = cells.min(axis=0)
+        cells -= self.origin
+        self.rows = int(cells[:, 1].max()) + 1
+        keys = cells[:, 0] * self.rows + cells[:, 1]
+        self.ids = np.argsort(keys, kind="stable")
+        self.keys = keys[self.ids]
+
+    def _column_ranges(self, cx0, cx1, cy0, cy1):
+        """Index ranges in self.ids of cells [cx0, cx1] x [cy0, cy1] (relative cell coordinates)"""
+        cy0, cy1 = max(cy0, 0), min(cy1, self.rows - 1)
+        if cy0 > cy1 or len(self.keys) == 0:
+            return []
+        columns = np.arange(max(cx0, 0), max(min(cx1, self.keys[-1] // self.rows), -1) + 1)
+        lo = np.searchsorted(self.keys, columns * self.rows + cy0, side="left")
+        hi = np.searchsorted(self.keys, columns * self.rows + cy1, side="right")
+        return [(a, b) for a, b in zip(lo.tolist(), hi.tolist()) if b > a]
+
+    def _gather(self, ranges):
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.ids[a:b] for a, b in ranges])
+
+    def query_rect(self, x0, y0, x1, y1):
+        """Ids of all points inside the rectangle (corners in any order)"""
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        (cx0, cy0), (cx1, cy1) = self._cells((x0, y0)) - self.origin, self._cells((x1, y1)) - self.origin
+        ids = self._gather(self._column_ranges(cx0, cx1, cy0, cy1))
+        pos = self.positions[ids]
+        inside = (pos[:, 0] >= x0) & (pos[:, 0] <= x1) & (pos[:, 1] >= y0) & (pos[:, 1] <= y1)
+        return ids[inside]
+
+    def query_point(self, x, y, radius, status=None):
+        """Id of the point nearest to (x, y) within radius, or None.
+
+        With status (the per-agent status column) dead agents are skipped; only the
+        candidates from the cells around (x, y) are looked up, never the whole column.
+        """
+        ids = self.query_rect(x - radius, y - radius, x + radius, y + radius)
+        if status is not None:
+            ids = ids[status[ids] != DEAD]
+        if len(ids) == 0:
+            return None
+        distance = np.hypot(self.positions[ids, 0] - x, self.positions[ids, 1] - y)
+        best = np.argmin(distance)
+        return int(ids[best]) if distance[best] <= radius else None
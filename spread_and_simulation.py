@@ -7,33 +7,40 @@ import agent
 num_agents = 100
 recovery_time = 30
 initially_infected = 8
-Graph = networkx.watts_strogatz_graph(num_agents,10,0.03)
-agents = {}
 
-for i in Graph.nodes():
-    mobility = random.uniform(0.3,1)
-    immunity = 0.1
-    age = random.randint(0,100)
-    agents[i] = agent.Agent(i,age,immunity,mobility)
 
+def build_network():
+    """Small-world graph of agents with a few initial infections and its spring layout"""
+    Graph = networkx.watts_strogatz_graph(num_agents,10,0.03)
+    agents = {}
 
-for u, v in Graph.edges():
-    agents[u].neighbours.append(v)
-    agents[v].neighbours.append(u)
+    for i in Graph.nodes():
+        mobility = random.uniform(0.3,1)
+        immunity = 0.1
+        age = random.randint(0,100)
+        agents[i] = agent.Agent(i,age,immunity,mobility)
 
 
-for i in random.sample(list(agents.keys()),initially_infected):
-    agents[i].infect(0)
+    for u, v in Graph.edges():
+        agents[u].neighbours.append(v)
+        agents[v].neighbours.append(u)
 
 
+    for i in random.sample(list(agents.keys()),initially_infected):
+        agents[i].infect(0)
 
-pos = networkx.spring_layout(Graph, k=0.3, iterations=100, seed=42)
+
+
+    pos = networkx.spring_layout(Graph, k=0.3, iterations=100, seed=42)
+    return Graph, agents, pos
 
 
 
 days = 100
-history = [] 
 def start_simulation():
+    # the network is built here and not at import time
+    Graph, agents, pos = build_network()
+    history = [] 
     pt.ion()  
     fig, ax = pt.subplots(figsize=(16, 12))
     ax.set_aspect('equal')
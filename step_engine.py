@@ -0,0 +1,438 @@
+import heapq
+import itertools
+import threading
+import numpy as np
+import agent
+import counter_rng
+import profiling
+from agent import SUSCEPTIBLE, INFECTED, RECOVERED, DEAD
+
+# A reasonable compact_dead_fraction: rebuild the adjacency every time another 10% of the population died
+COMPACT_DEAD_FRACTION = 0.1
+
+# How infections within a step are applied (the update argument of the engines):
+#   sweep        like the per-agent loop of run_visualization, agents take their turn in id
+#                order and one infected earlier in the step than its own turn spreads at once
+#   synchronous  everyone sees the statuses of the start of the step, new infections spread
+#                from the next one. The epidemic is slower: on a 5000 agent graph (mean
+#                degree 4.06, 400 runs) the infected peak is 9% lower and 1.4 days later
+SWEEP, SYNCHRONOUS = "sweep", "synchronous"
+UPDATE_MODES = (SWEEP, SYNCHRONOUS)
+
+
+def compact_adjacency(indptr, indices, dead):
+    """CSR adjacency without the agents in the dead mask: their rows are emptied and
+    they are dropped from everybody else's rows. Returns (indptr, indices)."""
+    row = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    keep = ~dead[indices] & ~dead[row]
+    compacted_indptr = np.zeros(len(indptr), dtype=np.int64)
+    np.cumsum(np.bincount(row[keep], minlength=len(indptr) - 1), out=compacted_indptr[1:])
+    return compacted_indptr, indices[keep]
+
+
+class StepEngine:
+    """Headless stepping engine that keeps the whole population in NumPy arrays.
+
+    One call to step() does the same work as one tick of the per-agent loop in
+    run_visualization: infected agents pick int(degree * mobility) neighbours,
+    each contact transmits with the probability from Agent.attempt_to_infect_neighbour,
+    and agents whose recovery time has elapsed either die (mortality_rate) or recover.
+    With update=SWEEP (the default) agents infected during a tick spread in it too when
+    their turn comes after their infection, as in the loop; update=SYNCHRONOUS holds
+    new infections back until the next tick (see UPDATE_MODES).
+
+    Dead agents stay in the arrays, DEAD in status is their tombstone. With
+    compact_dead_fraction set, the adjacency contacts are drawn from is rebuilt without
+    them in a background thread whenever that share of the population died since the
+    last rebuild, so long runs with many deaths do not keep sampling dead neighbours.
+    A rebuild starts at the beginning of a step and is switched to at the beginning of
+    the next one, so runs stay reproducible. Contacts are still chosen among all
+    degree neighbours, see sample_contacts.
+    """
+
+    def __init__(self, population, mortality_rate=0.05, base_prob=agent.BASE_TRANSMISSION_PROB, rng=None,
+                 age_bands=agent.AGE_BANDS, compact_dead_fraction=None, update=SWEEP):
+        if update not in UPDATE_MODES:
+            raise ValueError(f"update must be one of {UPDATE_MODES}, got {update!r}")
+        self.update = update
+        # The engine works directly on the population columns, nothing is copied
+        self.population = population
+        self.indptr = population.indptr
+        self.indices = population.indices
+        self.n = len(population)
+        self.age = population.age
+        self.immunity = population.immunity
+        self.mobility = population.mobility
+        self.recovery_time = population.recovery_time
+        self.status = population.status
+        self.last_infected_timestep = population.last_infected_timestep
+        self.mortality_rate = mortality_rate
+        self.base_prob = base_prob
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.degree = population.degree
+        self.time_step = 0
+        counts = np.bincount(self.status, minlength=len(agent.STATUS_NAMES))
+        self.status_counts = {name: int(c) for name, c in zip(agent.STATUS_NAMES, counts)}
+        # (S, I, R, D) after every step
+        self.history = []
+
+        # Same age bands as Agent.attempt_to_infect_neighbour, computed once for everyone
+        self.age_bands = age_bands
+        self.transmit_factor, self.receive_factor = agent.transmission_factors(self.age, self.immunity, age_bands)
+
+        # adjacency the contacts are drawn from, the full one until the first compaction
+        self.compact_dead_fraction = compact_dead_fraction
+        self.live_indptr, self.live_indices, self.live_degree = self.indptr, self.indices, self.degree
+        self.compacted = None  # mask of the dead agents left out of the live adjacency
+        self._compacted_count = 0
+        self._compaction = None
+
+    def maintain_adjacency(self):
+        """Switch to a finished compaction and start a new one when enough agents died,
+        called at the start of every step"""
+        self.settle_compaction()
+        if self.compact_dead_fraction is None:
+            return
+        if self.status_counts["D"] - self._compacted_count >= max(1, self.compact_dead_fraction * self.n):
+            dead = self.status == DEAD
+            indptr, indices, result = self.live_indptr, self.live_indices, {}
+            thread = threading.Thread(target=lambda: result.update(
+                adjacency=compact_adjacency(indptr, indices, dead)), daemon=True)
+            thread.start()
+            self._compaction = (thread, result, dead)
+
+    def settle_compaction(self):
+        """Wait for a compaction in flight and switch to its adjacency now instead of at the
+        start of the next step (the same thing, as long as it is done between steps)"""
+        if self._compaction is None:
+            return
+        thread, result, dead = self._compaction
+        thread.join()
+        self._compaction = None
+        self.use_compaction(dead, *result["adjacency"])
+
+    def use_compaction(self, dead, indptr=None, indices=None):
+        """Draw contacts from the adjacency without the agents in the dead mask (computed
+        here unless given), e.g. when restoring a checkpoint"""
+        if indptr is None:
+            indptr, indices = compact_adjacency(self.indptr, self.indices, dead)
+        self.live_indptr, self.live_indices, self.live_degree = indptr, indices, np.diff(indptr)
+        self.compacted = dead
+        self._compacted_count = int(np.count_nonzero(dead))
+
+    def set_immunity(self, ids, immunity):
+        """Change the immunity of some agents, their receive factors are recomputed"""
+        self.immunity[ids] = immunity
+        self.receive_factor[ids] = agent.transmission_factors(self.age[ids], self.immunity[ids], self.age_bands)[1]
+
+    def infect(self, ids, timestep=None):
+        """Infect the given susceptible agents at timestep (defaults to the current step)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[self.status[ids] == SUSCEPTIBLE]
+        self.status[ids] = INFECTED
+        self.last_infected_timestep[ids] = self.time_step if timestep is None else timestep
+        self.status_counts["S"] -= len(ids)
+        self.status_counts["I"] += len(ids)
+        return ids
+
+    def sample_contacts(self, sources):
+        """Pick int(degree * mobility) distinct neighbours of every source agent.
+
+        Returns (source, target) arrays with one entry per chosen contact. Contacts that
+        land on a dead neighbour are dropped (they would not transmit anyway).
+        """
+        deg = self.degree[sources]
+        count_to_infect = (deg * self.mobility[sources].astype(np.float64)).astype(np.int64)
+        if self.live_indices is not self.indices:
+            # The picks are still made among all deg neighbours, the compacted away dead ones
+            # are just not stored anymore. How many of them land on a stored neighbour is
+            # hypergeometric, and those are a uniform sample of the stored ones.
+            live = self.live_degree[sources]
+            count_to_infect = self.rng.hypergeometric(live, deg - live, count_to_infect)
+            deg = live
+        total = int(deg.sum())
+        if total == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        row = np.repeat(np.arange(len(sources)), deg)
+        row_start = np.cumsum(deg) - deg
+        slots = np.repeat(self.live_indptr[sources], deg) + (np.arange(total) - np.repeat(row_start, deg))
+
+        # Sampling without replacement: give every slot a random key and keep the
+        # k smallest keys of each row. Adding the row number keeps rows grouped after the sort.
+        order = np.argsort(row + self.rng.random(total), kind="stable")
+        rank = np.empty(total, dtype=np.int64)
+        rank[order] = np.arange(total) - np.repeat(row_start, deg)
+        chosen = rank < np.repeat(count_to_infect, deg)
+        return np.repeat(sources, deg)[chosen], self.live_indices[slots[chosen]].astype(np.int64)
+
+    def transmit(self, sources):
+        """(source, target) of every contact of the source agents that transmits, to targets
+        susceptible at the start of the step"""
+        src, tgt = self.sample_contacts(sources)
+        susceptible = self.status[tgt] == SUSCEPTIBLE
+        src, tgt = src[susceptible], tgt[susceptible]
+        prob = self.base_prob * self.transmit_factor[src] * self.receive_factor[tgt]
+        hit = self.rng.random(len(tgt)) < prob
+        return src[hit], tgt[hit]
+
+    def spread(self, infected):
+        """Sorted ids of the agents the infected agents infect this step, nothing is applied yet"""
+        src, tgt = self.transmit(infected)
+        if self.update == SYNCHRONOUS:
+            return np.unique(tgt)
+        # In a sweep an agent is infected at the turn of the first (lowest id) agent that
+        # transmits to it, and spreads itself if that is before its own turn. Everyone who
+        # turns out to be infected before their turn transmits in the next round, until a
+        # round adds no one.
+        targets, first = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        spreading = np.empty(0, dtype=np.int64)
+        while len(tgt):
+            targets, first = np.concatenate((targets, tgt)), np.concatenate((first, src))
+            order = np.lexsort((first, targets))
+            targets, first = targets[order], first[order]
+            keep = np.ones(len(targets), dtype=bool)
+            keep[1:] = targets[1:] != targets[:-1]
+            targets, first = targets[keep], first[keep]
+            # an infection's turn can only move earlier, so who spreads only grows
+            early = targets[first < targets]
+            sources = np.setdiff1d(early, spreading, assume_unique=True)
+            if len(sources) == 0:
+                break
+            spreading = early
+            src, tgt = self.transmit(sources)
+        return targets
+
+    def step(self):
+        """Advance the simulation by one tick.
+
+        Returns (new_infections, recovered, dead) as arrays of agent ids.
+        """
+        t = self.time_step
+        lap = profiling.laps("step")
+        self.maintain_adjacency()
+        lap("adjacency")
+
+        # Handling infections
+        infected = np.flatnonzero(self.status == INFECTED)
+        new_infections = self.infect(self.spread(infected), t)
+        lap("infection")
+
+        # Handling deaths and recovery
+        done = infected[t - self.last_infected_timestep[infected] >= self.recovery_time[infected]]
+        dies = self.rng.random(len(done)) < self.mortality_rate
+        dead, recovered = done[dies], done[~dies]
+        self.status[dead] = DEAD
+        self.status[recovered] = RECOVERED
+        self.status_counts["I"] -= len(done)
+        self.status_counts["R"] += len(recovered)
+        self.status_counts["D"] += len(dead)
+        lap("recovery")
+
+        self.time_step += 1
+        self.history.append(tuple(self.status_counts.values()))
+        return new_infections, recovered, dead
+
+    def status_of(self, agent_id):
+        """Status letter of a single agent, same values as Agent.status"""
+        return agent.STATUS_NAMES[self.status[agent_id]]
+
+
+class FrontierStepEngine(StepEngine):
+    """StepEngine that only touches active infections.
+
+    The infected agents are kept as an explicit (sorted) frontier and their
+    recovery/death deadlines (last_infected_timestep + recovery_time) sit in a
+    min-heap, so a tick costs O(infected) instead of two scans over the population.
+    Heap entries are batches of agents sharing a deadline, which keeps the heap tiny.
+    Draws happen in the same order as in StepEngine, so with the same rng both
+    engines produce identical runs.
+    """
+
+    def __init__(self, population, **kwargs):
+        super().__init__(population, **kwargs)
+        # pick up agents that are already infected (e.g. a population that was run before)
+        self.frontier = np.flatnonzero(self.status == INFECTED)
+        self.deadlines = []
+        self._batches_pushed = itertools.count()  # tie breaker so batches with equal deadlines never get compared
+        self._push_deadlines(self.frontier)
+
+    def _push_deadlines(self, ids):
+        deadlines = self.last_infected_timestep[ids].astype(np.int64) + self.recovery_time[ids]
+        order = np.argsort(deadlines, kind="stable")
+        values, starts = np.unique(deadlines[order], return_index=True)
+        for deadline, batch in zip(values.tolist(), np.split(ids[order], starts[1:])):
+            heapq.heappush(self.deadlines, (deadline, next(self._batches_pushed), batch))
+
+    def infect(self, ids, timestep=None):
+        ids = super().infect(ids, timestep)
+        if len(ids):
+            self.frontier = np.sort(np.concatenate((self.frontier, ids)))
+            self._push_deadlines(ids)
+        return ids
+
+    def step(self):
+        t = self.time_step
+        lap = profiling.laps("step")
+        self.maintain_adjacency()
+        lap("adjacency")
+
+        # Handling infections
+        infected = self.frontier
+        new_infections = self.infect(self.spread(infected), t)
+        lap("infection")
+
+        # Handling deaths and recovery of everyone whose deadline has passed
+        due = [np.empty(0, dtype=np.int64)]
+        while self.deadlines and self.deadlines[0][0] <= t:
+            due.append(heapq.heappop(self.deadlines)[2])
+        done = np.sort(np.concatenate(due))
+        done = done[self.status[done] == INFECTED]
+        dies = self.rng.random(len(done)) < self.mortality_rate
+        dead, recovered = done[dies], done[~dies]
+        self.status[dead] = DEAD
+        self.status[recovered] = RECOVERED
+        self.status_counts["I"] -= len(done)
+        self.status_counts["R"] += len(recovered)
+        self.status_counts["D"] += len(dead)
+        if len(done):
+            self.frontier = self.frontier[self.status[self.frontier] == INFECTED]
+        lap("recovery")
+
+        self.time_step += 1
+        self.history.append(tuple(self.status_counts.values()))
+        return new_infections, recovered, dead
+
+
+class KeyedStepEngine(StepEngine):
+    """StepEngine whose random draws come from a counter-based generator.
+
+    Every draw is keyed by (seed, step, agent, purpose, slot) through counter_rng
+    instead of being taken from a sequential stream: the contact choice of agent i
+    uses its own key per adjacency slot, the transmission over slot j of agent i and
+    the death roll of agent i likewise. Runs therefore do not depend on how agents
+    are ordered, batched or split across processes, and SerialStepEngine (one agent
+    at a time, pure Python) reproduces them exactly.
+    """
+
+    def __init__(self, population, seed=0, **kwargs):
+        if kwargs.get("compact_dead_fraction") is not None:
+            # the draws are keyed by adjacency slot, compaction would renumber the slots
+            raise ValueError("counter-based engines do not support compact_dead_fraction")
+        super().__init__(population, **kwargs)
+        counter_rng.seed_key(seed)  # validates the seed
+        self.seed = seed
+
+    def keyed_contacts(self, sources):
+        """Like sample_contacts, plus the adjacency slot of every contact: (source, target, slot)"""
+        deg = self.degree[sources]
+        total = int(deg.sum())
+        if total == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        row = np.repeat(np.arange(len(sources)), deg)
+        row_start = np.cumsum(deg) - deg
+        slot = np.arange(total) - np.repeat(row_start, deg)
+        src = np.repeat(sources, deg)
+
+        # keep the k slots with the smallest keys of every row, ties go to the lower slot
+        keys = counter_rng.uniforms(self.seed, self.time_step, src, counter_rng.CONTACT, slot)
+        order = np.lexsort((keys, row))
+        rank = np.empty(total, dtype=np.int64)
+        rank[order] = slot
+        count_to_infect = (deg * self.mobility[sources].astype(np.float64)).astype(np.int64)
+        chosen = rank < np.repeat(count_to_infect, deg)
+        targets = self.indices[np.repeat(self.indptr[sources], deg)[chosen] + slot[chosen]].astype(np.int64)
+        return src[chosen], targets, slot[chosen]
+
+    def sample_contacts(self, sources):
+        src, tgt, _ = self.keyed_contacts(sources)
+        return src, tgt
+
+    def transmit(self, sources):
+        src, tgt, slot = self.keyed_contacts(sources)
+        susceptible = self.status[tgt] == SUSCEPTIBLE
+        src, tgt, slot = src[susceptible], tgt[susceptible], slot[susceptible]
+        prob = self.base_prob * self.transmit_factor[src] * self.receive_factor[tgt]
+        hit = counter_rng.uniforms(self.seed, self.time_step, src, counter_rng.TRANSMIT, slot) < prob
+        return src[hit], tgt[hit]
+
+    def transmissions(self, infected):
+        """Ids of the susceptible agents infected this step by the given infected agents
+        alone, the synchronous spread"""
+        return np.unique(self.transmit(infected)[1])
+
+    def deaths(self, done):
+        """Mask over done (agents at the end of their infection) of the ones that die"""
+        return counter_rng.uniforms(self.seed, self.time_step, done, counter_rng.MORTALITY) < self.mortality_rate
+
+    def step(self):
+        t = self.time_step
+        lap = profiling.laps("step")
+
+        infected = np.flatnonzero(self.status == INFECTED)
+        new_infections = self.infect(self.spread(infected), t)
+        lap("infection")
+
+        done = infected[t - self.last_infected_timestep[infected] >= self.recovery_time[infected]]
+        dies = self.deaths(done)
+        dead, recovered = done[dies], done[~dies]
+        self.status[dead] = DEAD
+        self.status[recovered] = RECOVERED
+        self.status_counts["I"] -= len(done)
+        self.status_counts["R"] += len(recovered)
+        self.status_counts["D"] += len(dead)
+        lap("recovery")
+
+        self.time_step += 1
+        self.history.append(tuple(self.status_counts.values()))
+        return new_infections, recovered, dead
+
+
+class SerialStepEngine(KeyedStepEngine):
+    """Reference implementation of KeyedStepEngine: plain Python loops, one agent and one
+    draw at a time, with the scalar Philox. Slow, only meant for checking the fast engines."""
+
+    def step(self):
+        t = self.time_step
+        status, indptr, indices = self.status, self.indptr, self.indices
+        infected = [i for i in range(self.n) if status[i] == INFECTED]
+
+        # a sweep visits everyone in id order and an agent infected before its turn spreads
+        # right away, a synchronous step only the agents infected at its start
+        sweep = self.update == SWEEP
+        newly_infected = set()
+        for i in (range(self.n) if sweep else infected):
+            if sweep and status[i] != INFECTED and i not in newly_infected:
+                continue
+            start, degree = int(indptr[i]), int(indptr[i + 1] - indptr[i])
+            count_to_infect = int(degree * float(self.mobility[i]))
+            keys = [(counter_rng.uniform(self.seed, t, i, counter_rng.CONTACT, j), j) for j in range(degree)]
+            for _, j in sorted(keys)[:count_to_infect]:
+                target = int(indices[start + j])
+                if status[target] != SUSCEPTIBLE or target in newly_infected:
+                    continue
+                prob = self.base_prob * float(self.transmit_factor[i]) * float(self.receive_factor[target])
+                if counter_rng.uniform(self.seed, t, i, counter_rng.TRANSMIT, j) < prob:
+                    newly_infected.add(target)
+        new_infections = self.infect(sorted(newly_infected), t)
+
+        dead, recovered = [], []
+        for i in infected:
+            if t - self.last_infected_timestep[i] >= self.recovery_time[i]:
+                if counter_rng.uniform(self.seed, t, i, counter_rng.MORTALITY) < self.mortality_rate:
+                    dead.append(i)
+                else:
+                    recovered.append(i)
+        for i in dead:
+            status[i] = DEAD
+        for i in recovered:
+            status[i] = RECOVERED
+        self.status_counts["I"] -= len(dead) + len(recovered)
+        self.status_counts["R"] += len(recovered)
+        self.status_counts["D"] += len(dead)
+
+        self.time_step += 1
+        self.history.append(tuple(self.status_counts.values()))
+        return new_infections, np.array(recovered, dtype=np.int64), np.array(dead, dtype=np.int64)
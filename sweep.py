@@ -0,0 +1,182 @@
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import ensemble
+from graphs_and_clustering import create_graph
+
+# Parameters a sweep grid may contain, with their defaults
+SWEEP_PARAMS = dict(ensemble.DEFAULT_PARAMS, num_of_agents_in_cluster=20)
+
+# Modules whose source decides the result of a cell, editing any of them invalidates the cache.
+# This one too, run_cell decides the seeds, the graph and which params reach the model
+MODEL_MODULES = ("agent.py", "population.py", "graphs_and_clustering.py", "connectivity.py",
+                 "step_engine.py", "ensemble.py", "sweep.py")
+
+_code_version = None
+
+
+def code_version():
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in MODEL_MODULES:
+            with open(os.path.join(here, name), "rb") as f:
+                digest.update(f.read())
+        _code_version = digest.hexdigest()[:16]
+    return _code_version
+
+
+class ResultCache:
+    """Content-addressed on-disk store of cell results (one .npy file per key).
+
+    Entries older than max_age seconds are dropped, and when the cache grows past
+    max_bytes the least recently used entries go first (hits refresh the mtime).
+    """
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(description):
+        """Hash of a JSON serialisable description of the cell (params, seed, code version...)"""
+        blob = json.dumps(description, sort_keys=True).encode()
+        return hashlib.sha256(blob).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".npy")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            result = np.load(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        if self.max_age is not None and time.time() - os.path.getmtime(path) > self.max_age:
+            return None
+        os.utime(path)
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so a reader never sees half a file even with concurrent sweeps
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, result)
+        os.replace(tmp, path)
+
+    def entries(self):
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".npy"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def evict(self):
+        """Apply max_age and max_bytes, returns the number of removed entries"""
+        entries = sorted(self.entries())
+        removed = 0
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+
+def grid_cells(grid):
+    """Every combination of the values in grid ({name: [values]}), as full parameter dicts"""
+    unknown = set(grid) - set(SWEEP_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+    names = sorted(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(SWEEP_PARAMS, **dict(zip(names, values)))
+
+
+# populations generated by this process, cells with the same graph parameters reuse them
+_populations = {}
+
+
+def run_cell(total_population, steps, params, seed):
+    """Result of one sweep cell: the (S, I, R, D) history of one run"""
+    graph_key = (total_population, params["num_of_agents_in_cluster"], seed)
+    if graph_key not in _populations:
+        _populations.clear()
+        _populations[graph_key] = create_graph(total_population, params["num_of_agents_in_cluster"], seed=seed)
+    model_params = {name: params[name] for name in ensemble.DEFAULT_PARAMS}
+    return ensemble.run_replicate(_populations[graph_key], steps, seed, model_params)
+
+
+def _run_cell_job(args):
+    key, total_population, steps, params, seed = args
+    return key, run_cell(total_population, steps, params, seed)
+
+
+def run_sweep(grid, total_population, steps, seeds=(0,), cache_dir=None, workers=None,
+              max_bytes=None, max_age=None):
+    """Run every cell of grid for every seed, reusing cached cells.
+
+    Returns a list of {"params", "seed", "history", "cached"} dicts in grid order.
+    Only cells missing from the cache are computed (in parallel), so extending a grid
+    or adding seeds only pays for the new cells.
+    """
+    cache = ResultCache(cache_dir, max_bytes, max_age) if cache_dir else None
+    cells = []
+    for params in grid_cells(grid):
+        for seed in seeds:
+            description = {"params": params, "seed": seed, "steps": steps,
+                           "total_population": total_population, "code_version": code_version()}
+            key = ResultCache.key(description)
+            history = cache.get(key) if cache else None
+            cells.append({"params": params, "seed": seed, "key": key,
+                          "history": history, "cached": history is not None})
+
+    missing = [cell for cell in cells if cell["history"] is None]
+    # cells sharing a graph end up next to each other, so workers can reuse their last population
+    jobs = [(cell["key"], total_population, steps, cell["params"], cell["seed"])
+            for cell in sorted(missing, key=lambda c: (c["params"]["num_of_agents_in_cluster"], c["seed"]))]
+    workers = min(workers or os.cpu_count() or 1, max(1, len(jobs)))
+    if workers <= 1:
+        results = map(_run_cell_job, jobs)
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(_run_cell_job, jobs)
+
+    by_key = {}
+    try:
+        for key, history in results:
+            by_key[key] = history
+            if cache:
+                cache.put(key, history)
+    finally:
+        if workers > 1:
+            pool.close()
+            pool.join()
+
+    for cell in missing:
+        cell["history"] = by_key[cell["key"]]
+    if cache:
+        cache.evict()
+    for cell in cells:
+        del cell["key"]
+    return cells